@@ -47,12 +47,12 @@ def main():
     config["LLM_BACKEND"] = backend
     
     # 3. Output Format
-    fmt = get_input("Choose Output Format (image/drawio)", config.get("OUTPUT_FORMAT", "image"))
-    assert fmt in ["image", "drawio"], "Format must be 'image' or 'drawio'"
+    fmt = get_input("Choose Output Format (image/drawio/hybrid)", config.get("OUTPUT_FORMAT", "image"))
+    assert fmt in ["image", "drawio", "hybrid"], "Format must be 'image', 'drawio' or 'hybrid'"
     config["OUTPUT_FORMAT"] = fmt
     
     # 4. Draw.io Path (if needed)
-    if config["OUTPUT_FORMAT"] == "drawio":
+    if config["OUTPUT_FORMAT"] in ["drawio", "hybrid"]:
         if(os.getenv("DRAWIO_PATH")==""):
             config["DRAWIO_PATH"] = get_input("Enter path to Draw.io executable (e.g. AppImage)", config.get("DRAWIO_PATH", ""))
         else:
@@ -1,11 +1,18 @@
 from .client import client_instance
 from .config import config
+from .cache import critique_cache
+from .layout import repair_xml, has_overlaps, layered_layout, structure_fingerprint
 from PIL import Image
 import io
 import json
 import subprocess
 import os
 
+def parse_json(response_text: str):
+    """Parses a JSON response, tolerating markdown code fences around it."""
+    clean_text = response_text.replace('```json', '').replace('```', '').strip()
+    return json.loads(clean_text)
+
 class Retriever:
     """Mock retriever that returns hardcoded examples."""
     def retrieve(self, query: str, k: int = 3):
@@ -35,10 +42,30 @@ class Planner:
 
 class Stylist:
     """Refines the description to adhere to aesthetic guidelines."""
-    def style(self, description: str) -> str:
+    def guidelines(self, context: str, examples: list[str]) -> str:
+        """Derives paper-wide style guidelines shared by every figure of one paper."""
+        prompt = f"""
+        You are a design expert preparing the figure style guide for a scientific paper.
+        Based on the paper content and reference examples below, define concise visual guidelines
+        following NeurIPS style: a professional color palette (avoiding saturated primaries) with
+        fixed colors for recurring concepts, typography, line styles, and iconography.
+        All figures of the paper will be drawn with these guidelines, so keep them consistent and specific.
+        
+        Paper Content:
+        {context}
+        
+        Examples:
+        {chr(10).join(examples)}
+        
+        Style Guidelines:
+        """
+        return client_instance.generate_text(prompt)
+
+    def style(self, description: str, guidelines: str = None) -> str:
         prompt = f"""
         You are a design expert. Refine the following diagram description to strictly follow NeurIPS style guidelines.
         Ensure clarity, professional color palette (avoiding saturated primaries), and legible typography.
+        {f"Apply these paper-wide style guidelines so the figure matches the rest of the paper:{chr(10)}{guidelines}" if guidelines else ""}
         
         Description:
         {description}
@@ -49,14 +76,30 @@ class Stylist:
 
 class Visualizer:
     """Generates an image from the description."""
-    def visualize(self, description: str) -> Image.Image:
+    def visualize(self, description: str, size: str = None, steps: int = None) -> bytes:
         # Using configured image model
-        return client_instance.generate_image(description)
+        return client_instance.generate_image(description, size=size, steps=steps)
+
+    def finalize(self, draft: bytes, description: str, size: str = None) -> bytes:
+        """Re-renders an accepted draft at full quality with the image-edit model, keeping its composition."""
+        prompt = f"""
+        Re-render this draft of a scientific diagram at full quality.
+        Keep the composition, layout, all text, arrows and connections exactly where they are.
+        Only sharpen details and apply the refinements in the description below.
+        
+        Description:
+        {description}
+        """
+        return client_instance.edit_image(prompt, draft, size=size)
+
+    def resolution(self, size: str = None, steps: int = None) -> tuple:
+        """The (size, steps) the backend actually renders for a request."""
+        return client_instance.effective_resolution(size, steps)
 
 
 class SketchGenerator:
     """Generates a rough prototype sketch to guide the final diagram creation."""
-    def sketch(self, description: str) -> Image.Image:
+    def sketch(self, description: str, size: str = None, steps: int = None) -> bytes:
         prompt = f"""
         Create a rough, low-fidelity prototype sketch for the following scientific diagram.
         Focus on layout, composition, and relative positioning of elements.
@@ -66,10 +109,18 @@ class SketchGenerator:
         {description}
         """
         # Using configured image model
-        return client_instance.generate_image(prompt)
+        return client_instance.generate_image(prompt, size=size, steps=steps)
 
 class DrawIOBuilder:
     """Generates Draw.io XML based on the refined description and sketch critique."""
+    SCHEMA = {
+        "type": "object",
+        "properties": {
+            "xml": {"type": "string"}
+        },
+        "required": ["xml"]
+    }
+
     def build(self, description: str, critique_suggestions: str = None) -> str:
         prompt = f"""
         You are an expert in creating Draw.io (mxGraph) XML diagrams.
@@ -84,22 +135,43 @@ class DrawIOBuilder:
         1. Use standard mxGraph XML format.
         2. For any text containing math or equations, use LaTeX syntax (e.g., $$x^2$$ or \( \alpha \)).
         3. Ensure the diagram is well-laid out and readable.
-        4. Output ONLY the raw XML code. Do not include markdown code blocks (e.g., ```xml).
+        4. Return the complete raw XML code in the "xml" field. Do not include markdown code blocks (e.g., ```xml).
         """
         
-        response = client_instance.generate_text(prompt)
+        response = client_instance.generate_text(prompt, schema=self.SCHEMA)
+        
+        try:
+            return parse_json(response)["xml"].strip()
+        except Exception:
+            # Backend ignored the schema and returned the XML directly
+            pass
         
         # Clean up response if it contains markdown code blocks
         clean_xml = response.replace('```xml', '').replace('```', '').strip()
         return clean_xml
 
+class LayoutEngine:
+    """Validates, repairs and lays out Draw.io XML locally before it is rendered."""
+    def process(self, xml: str) -> str:
+        xml, issues = repair_xml(xml)
+        for issue in issues:
+            print(f"XML repair: {issue}")
+            
+        if config.DRAWIO_LAYOUT == "always" or (config.DRAWIO_LAYOUT == "auto" and has_overlaps(xml)):
+            print("Applying layered layout...")
+            try:
+                xml = layered_layout(xml, direction=config.DRAWIO_LAYOUT_DIRECTION)
+            except Exception as e:
+                # The repaired XML still renders, only without the layout
+                print(f"Layout failed, keeping the generated positions: {e}")
+        return xml
+
 class Renderer:
     """Handles rendering of Draw.io XML to images using the local Draw.io CLI."""
     def render(self, xml_path: str, output_path: str) -> bool:
         
-        drawio_path = config.DRAWIO_PATH
-        if not drawio_path or not os.path.exists(drawio_path):
-            print("Error: DRAWIO_PATH not configured or executable not found.")
+        drawio_path = self._drawio_path()
+        if not drawio_path:
             return False
             
         # Command: {DRAWIO_PATH} -x -f png -o {output_path} {xml_path}
@@ -107,7 +179,84 @@ class Renderer:
         # -f png: Format PNG
         # --crop: Crop to content (optional but good)
         cmd = [drawio_path, "-x", "-f", "png", "--crop", "-o", output_path, xml_path]
+        return self._run(cmd)
+
+    def export(self, xml_path: str, formats: list[str] = None, scales: list[float] = None) -> list[str]:
+        """
+        Exports a diagram to every requested format and scale next to the source file,
+        running the Draw.io exports in parallel. Returns the paths that were written.
+        e.g. final_diagram.drawio -> final_diagram.png, final_diagram@2x.png, final_diagram.svg, ...
+        """
+        import concurrent.futures
+        
+        drawio_path = self._drawio_path()
+        if not drawio_path:
+            return []
+            
+        formats = formats or config.EXPORT_FORMATS
+        scales = scales or config.EXPORT_SCALES
         
+        jobs = {}
+        for fmt in formats:
+            for scale in scales:
+                output_path = self.export_path(xml_path, fmt, scale)
+                jobs[output_path] = [drawio_path, "-x", "-f", fmt, "--scale", f"{scale:g}", "--crop", "-o", output_path, xml_path]
+        if not jobs:
+            # Exports are disabled (e.g. EXPORT_FORMATS=)
+            return []
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            futures = {executor.submit(self._run, cmd): output_path for output_path, cmd in jobs.items()}
+            exported = [futures[future] for future in concurrent.futures.as_completed(futures) if future.result()]
+            
+        return sorted(exported)
+
+    def export_path(self, xml_path: str, fmt: str, scale: float = 1) -> str:
+        """Path written by export() for one format and scale."""
+        suffix = "" if scale == 1 else f"@{scale:g}x"
+        return f"{os.path.splitext(xml_path)[0]}{suffix}.{fmt}"
+
+    def export_directory(self, input_dir: str, formats: list[str] = None, scales: list[float] = None) -> bool:
+        """
+        Bulk export of every final_diagram.drawio under a batch directory (e.g. batch_<n>/ or <figure>/).
+        Each diagram is exported by export() next to its source, the diagrams are exported in parallel.
+        Intermediate diagram_v<i>.drawio files are skipped.
+        """
+        import concurrent.futures
+        
+        if not self._drawio_path():
+            return False
+            
+        formats = formats or config.EXPORT_FORMATS
+        scales = scales or config.EXPORT_SCALES
+        if not formats or not scales:
+            print("No export formats configured, nothing to export.")
+            return True
+            
+        xml_paths = sorted(
+            os.path.join(directory, "final_diagram.drawio")
+            for directory, _, files in os.walk(input_dir) if "final_diagram.drawio" in files
+        )
+        if not xml_paths:
+            print(f"No final_diagram.drawio found under '{input_dir}'.")
+            return True
+        
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            results = list(executor.map(lambda xml_path: self.export(xml_path, formats, scales), xml_paths))
+            
+        expected = [self.export_path(xml_path, fmt, scale) for xml_path in xml_paths for fmt in formats for scale in scales]
+        exported = {path for paths in results for path in paths}
+        print(f"Exported {len(xml_paths)} diagrams ({len(exported)}/{len(set(expected))} files).")
+        return all(path in exported for path in expected)
+
+    def _drawio_path(self):
+        drawio_path = config.DRAWIO_PATH
+        if not drawio_path or not os.path.exists(drawio_path):
+            print("Error: DRAWIO_PATH not configured or executable not found.")
+            return None
+        return drawio_path
+
+    def _run(self, cmd: list[str]) -> bool:
         try:
             # Setting environment for headless run if needed (e.g. xvfb-run)
             # For now assuming AppImage works directly or user has set up environment
@@ -121,9 +270,32 @@ class Renderer:
             print(f"Unexpected error during rendering: {e}")
             return False
 
+class Polisher:
+    """Applies a single stylistic polish pass to a rendered Draw.io diagram (hybrid mode)."""
+    def polish(self, image: bytes, description: str) -> bytes:
+        prompt = f"""
+        Polish this scientific diagram for publication.
+        Keep the layout, all text, equations, arrows and connections exactly where they are.
+        Only improve the visual style: a professional, harmonious color palette (avoiding saturated primaries),
+        clean shapes, consistent line weights and legible typography, matching the description below.
+        
+        Description:
+        {description}
+        """
+        return client_instance.edit_image(prompt, image)
+
 class Critic:
     """Evaluates the generated image and provides feedback."""
-    def critique(self, image: Image.Image, original_context: str, previous_description: str) -> dict:
+    SCHEMA = {
+        "type": "object",
+        "properties": {
+            "critic_suggestions": {"type": "string"},
+            "revised_description": {"type": "string"}
+        },
+        "required": ["critic_suggestions", "revised_description"]
+    }
+
+    def critique(self, image: bytes, original_context: str, previous_description: str) -> dict:
         prompt_text = f"""
         You are a Lead Visual Designer. Critique this generated diagram based on the original context.
         
@@ -142,19 +314,30 @@ class Critic:
         }}
         """
         
-        # Pass text and image to client (multimodal request)
-        response_text = client_instance.generate_text([prompt_text, image])
+        def request():
+            # Pass text and image to client (multimodal request)
+            response_text = client_instance.generate_text([prompt_text, image], schema=self.SCHEMA)
+            return parse_json(response_text)
         
         try:
-            clean_text = response_text.replace('```json', '').replace('```', '').strip()
-            return json.loads(clean_text)
+            # Keyed on the input only, the description changes every iteration and the image already shows it
+            return critique_cache.get_or_compute("critic", [original_context], image, request)
         except Exception as e:
             print(f"Error parsing critic JSON: {e}")
             return {"revised_description": previous_description, "critic_suggestions": "Error parsing response."}
 
 class DiagramCritic:
     """Specialized critic for reviewing rendered Draw.io diagrams."""
-    def critique(self, image: Image.Image, original_context: str) -> str:
+    SCHEMA = {
+        "type": "object",
+        "properties": {
+            "no_changes_needed": {"type": "boolean"},
+            "suggestions": {"type": "array", "items": {"type": "string"}}
+        },
+        "required": ["no_changes_needed", "suggestions"]
+    }
+
+    def critique(self, image: bytes, original_context: str, xml: str = None) -> str:
         prompt_text = f"""
         You are a Technical Editor. Review this rendered Draw.io diagram.
         
@@ -167,11 +350,28 @@ class DiagramCritic:
         3. Readability of text and connections.
         
         Provide a concise list of specific changes needed to improve the diagram XML.
-        If the diagram is perfect, say "No changes needed."
+        If the diagram is perfect, set "no_changes_needed" to true and leave "suggestions" empty.
         
-        Output format: Plain text list of suggestions.
+        Output format: JSON with "no_changes_needed" and a "suggestions" list.
         """
         
-        return client_instance.generate_text([prompt_text, image])
+        def request():
+            response_text = client_instance.generate_text([prompt_text, image], schema=self.SCHEMA)
+            
+            try:
+                result = parse_json(response_text)
+                suggestions = [suggestion for suggestion in result["suggestions"] if suggestion.strip()]
+                # Without any suggestion there is nothing to refine, whatever the flag says
+                if not suggestions:
+                    return "No changes needed."
+                return "\n".join(f"- {suggestion}" for suggestion in suggestions)
+            except Exception:
+                # Backend ignored the schema, use the plain text suggestions
+                return response_text
+        
+        # A small image hash cannot see LaTeX or label changes, so only renders showing the same labels,
+        # styles and connections share a critique, the hash then matches renders that only moved a little
+        fingerprint = structure_fingerprint(xml) if xml else ""
+        return critique_cache.get_or_compute("diagram_critic", [original_context, fingerprint], image, request)
 
 
@@ -0,0 +1,63 @@
+from .config import config
+from .images import perceptual_hash
+import hashlib
+import threading
+
+class CritiqueCache:
+    """
+    Reuses critiques of near-identical images across iterations and jobs.
+    Entries are keyed by the critic and a digest of its text context, and matched by
+    perceptual hash within a Hamming distance threshold.
+    """
+    def __init__(self, threshold: int, enabled: bool = True, hash_size: int = 16):
+        self.threshold = threshold
+        self.hash_size = hash_size
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, kind: str, context: list[str], image: bytes, compute):
+        """Returns a cached critique for a similar image in the same context, or computes and caches it."""
+        if not self.enabled:
+            return compute()
+            
+        try:
+            image_hash = perceptual_hash(image, self.hash_size)
+        except Exception as e:
+            print(f"Failed to hash image for critique cache: {e}")
+            return compute()
+            
+        key = self._key(kind, context)
+        with self._lock:
+            for cached_hash, result in self._entries.get(key, []):
+                if bin(cached_hash ^ image_hash).count("1") <= self.threshold:
+                    self.hits += 1
+                    print(f"Reusing {kind} critique of a near-identical image.")
+                    return result
+            self.misses += 1
+            
+        result = compute()
+        # Failed critiques are not cached so they are retried
+        if result:
+            with self._lock:
+                self._entries.setdefault(key, []).append((image_hash, result))
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def report(self) -> str:
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0
+        return f"Critique cache: {self.hits}/{lookups} hits ({rate:.0%})"
+
+    def _key(self, kind: str, context: list[str]) -> str:
+        digest = hashlib.sha256("\0".join(context).encode("utf-8")).hexdigest()
+        return f"{kind}:{digest}"
+
+critique_cache = CritiqueCache(config.CRITIQUE_CACHE_THRESHOLD, enabled=config.CRITIQUE_CACHE_ENABLED)
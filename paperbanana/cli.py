@@ -1,29 +1,81 @@
 import argparse
+import json
 import sys
 from .pipeline import Pipeline
+from .agents import Renderer
+from .cache import critique_cache
 from .config import config
 
+def load_figure_spec(spec_path: str) -> dict:
+    """
+    Loads a multi-figure job spec, e.g.:
+    {"input": "paper.txt", "output_dir": "outputs/paper", "figures": [{"name": "overview", "caption": "..."}]}
+    """
+    with open(spec_path, "r") as f:
+        spec = json.load(f)
+    if not spec.get("input") or not spec.get("figures"):
+        raise ValueError("Figure spec must define 'input' and a non-empty 'figures' list.")
+    names = set()
+    for i, figure in enumerate(spec["figures"]):
+        if not figure.get("caption"):
+            raise ValueError("Every figure in the spec must define a 'caption'.")
+        # Each figure is written to its own sub-directory, named like in Pipeline.generate_figures
+        name = figure.get("name") or f"figure_{i+1}"
+        if name in (".", "..") or "/" in name or "\\" in name:
+            raise ValueError(f"Figure name '{name}' must not be a path.")
+        if name in names:
+            raise ValueError(f"Figure name '{name}' is used more than once.")
+        names.add(name)
+    return spec
+
 def main():
     parser = argparse.ArgumentParser(description="PaperBanana: Automated Academic Illustration")
-    parser.add_argument("--input", required=True, help="Path to input text file containing methodology description.")
+    parser.add_argument("--input", required=False, help="Path to input text file containing methodology description.")
     parser.add_argument("--caption", required=False, help="Caption for the diagram.")
-    parser.add_argument("--output", required=True, help="Path to save the final output image.")
+    parser.add_argument("--output", required=False, help="Path to save the final output image.")
+    parser.add_argument("--spec", required=False, help="Path to a JSON multi-figure job spec (one paper, many captions).")
+    parser.add_argument("--export-dir", required=False, help="Export every final_diagram.drawio in a batch directory to the configured formats and exit.")
     parser.add_argument("--iterations", type=int, default=config.DEFAULT_ITERATIONS, help="Number of refinement iterations.")
-    
+
     args = parser.parse_args()
-    
+
+    if args.export_dir:
+        if not Renderer().export_directory(args.export_dir):
+            sys.exit(1)
+        return
+
+    if args.spec:
+        try:
+            spec = load_figure_spec(args.spec)
+            with open(spec["input"], "r") as f:
+                paper_text = f.read()
+        except FileNotFoundError as e:
+            print(f"Error: File '{e.filename}' not found.")
+            sys.exit(1)
+        except ValueError as e:
+            print(f"Error: Invalid figure spec: {e}")
+            sys.exit(1)
+
+        pipeline = Pipeline(iterations=args.iterations)
+        pipeline.generate_figures(paper_text, spec["figures"], output_dir=spec.get("output_dir"))
+        return
+
+    if not args.input or not args.output:
+        parser.error("--input and --output are required unless --spec or --export-dir is given.")
+
     try:
         with open(args.input, "r") as f:
             input_text = f.read()
     except FileNotFoundError:
         print(f"Error: Input file '{args.input}' not found.")
         sys.exit(1)
-        
+
     if args.caption:
         input_text += f"\n\nCaption: {args.caption}"
-        
+
     pipeline = Pipeline(iterations=args.iterations)
     pipeline.generate(input_text)
+    print(critique_cache.report())
 
 if __name__ == "__main__":
     main()
@@ -7,58 +7,135 @@ import io
 import requests
 import json
 import base64
+import gzip
+import hashlib
+import threading
+from collections import defaultdict, deque
 from .config import config
+from .images import encode_image, to_png
 
 class BaseClient(ABC):
     @abstractmethod
-    def generate_text(self, prompt: str, model: str = None) -> str:
+    def generate_text(self, prompt: str, model: str = None, schema: dict = None) -> str:
+        """
+        Generates text for a prompt (or a list of text and images).
+        If a JSON schema is given, the backend is asked to constrain its output to that schema.
+        """
         pass
 
     @abstractmethod
-    def generate_image(self, prompt: str, model: str = None) -> Optional[Image.Image]:
+    def generate_image(self, prompt: str, model: str = None, size: str = None, steps: int = None) -> Optional[bytes]:
+        """
+        Generates an image, optionally at a given "WIDTHxHEIGHT" size and number of sampling steps.
+        The image is returned as encoded PNG bytes, it is never decoded by the client.
+        """
+        pass
+
+    @abstractmethod
+    def edit_image(self, prompt: str, image: bytes, model: str = None, size: str = None) -> Optional[bytes]:
+        """
+        Edits an encoded (PNG) image according to the prompt, optionally at a given "WIDTHxHEIGHT" output size.
+        Returns the edited image as encoded PNG bytes.
+        """
+        pass
+
+    def effective_resolution(self, size: str = None, steps: int = None) -> tuple:
+        """
+        The (size, steps) the backend actually produces for a requested size and number of sampling steps.
+        Two requests with the same effective resolution give the same kind of image.
+        """
+        return size, steps
+
+    def clear_vram(self, keep: str = None) -> None:
+        """
+        Frees GPU memory held by the models not needed for the next phase ("text" or "image").
+        Hosted backends have nothing to free.
+        """
         pass
 
 class GeminiClient(BaseClient):
     def __init__(self):
         self.client = genai.Client(api_key=config.GOOGLE_API_KEY)
         
-    def generate_text(self, prompt: str, model: str = None) -> str:
+    def generate_text(self, prompt: str, model: str = None, schema: dict = None) -> str:
         model = model or config.VLM_MODEL
         try:
-             # Check if prompt contains image data (e.g. for critic)
-            if isinstance(prompt, list):
-                response = self.client.models.generate_content(
-                    model=model,
-                    contents=prompt,
-                    config=types.GenerateContentConfig(
-                        response_mime_type="application/json" if "application/json" in str(prompt) else "text/plain"
-                    )
+            contents = prompt
+            generation_config = None
+            if schema:
+                # Schema-constrained JSON output
+                generation_config = types.GenerateContentConfig(
+                    response_mime_type="application/json",
+                    response_schema=schema
                 )
-            else:
-                response = self.client.models.generate_content(
-                    model=model,
-                    contents=prompt
+            
+            # Check if prompt contains image data (e.g. for critic)
+            if isinstance(prompt, list):
+                # Encoded images are passed as PNG bytes
+                contents = [
+                    types.Part.from_bytes(data=item, mime_type="image/png") if isinstance(item, bytes) else item
+                    for item in prompt
+                ]
+                text = " ".join(item for item in prompt if isinstance(item, str))
+                generation_config = generation_config or types.GenerateContentConfig(
+                    response_mime_type="application/json" if "application/json" in text else "text/plain"
                 )
+            
+            response = self.client.models.generate_content(
+                model=model,
+                contents=contents,
+                config=generation_config
+            )
             return response.text
         except Exception as e:
             print(f"Gemini text generation error: {e}")
             return ""
 
-    def generate_image(self, prompt: str, model: str = None) -> Optional[Image.Image]:
+    def generate_image(self, prompt: str, model: str = None, size: str = None, steps: int = None) -> Optional[bytes]:
         model = model or config.IMAGE_MODEL
         try:
+            # Imagen has no sampling steps and only 1K/2K outputs, so only large sizes are requested explicitly
+            large = size and max(int(side) for side in size.split("x")) > 1024
             response = self.client.models.generate_images(
                 model=model,
                 prompt=prompt,
                 config=types.GenerateImagesConfig(
-                    number_of_images=1
+                    number_of_images=1,
+                    image_size="2K" if large else None
                 )
             )
             image_bytes = response.generated_images[0].image.image_bytes
-            return Image.open(io.BytesIO(image_bytes))
+            return to_png(image_bytes)
         except Exception as e:
             print(f"Gemini image generation error: {e}")
             return None
+
+    def effective_resolution(self, size: str = None, steps: int = None) -> tuple:
+        # Same rule as generate_image: anything up to 1024 is a default 1K request
+        large = size and max(int(side) for side in size.split("x")) > 1024
+        return "2K" if large else "1K", None
+
+    def edit_image(self, prompt: str, image: bytes, model: str = None, size: str = None) -> Optional[bytes]:
+        model = model or config.EDIT_MODEL
+        try:
+            # Same rule as generate_image, 2K output needs an EDIT_MODEL that supports it
+            large = self.effective_resolution(size)[0] == "2K"
+            response = self.client.models.generate_content(
+                model=model,
+                contents=[prompt, types.Part.from_bytes(data=image, mime_type="image/png")],
+                config=types.GenerateContentConfig(
+                    response_modalities=["IMAGE"],
+                    image_config=types.ImageConfig(image_size="2K") if large else None
+                )
+            )
+            for part in response.candidates[0].content.parts:
+                if part.inline_data and part.inline_data.data:
+                    return to_png(part.inline_data.data)
+            print("Gemini image edit returned no image.")
+            return None
+        except Exception as e:
+            print(f"Gemini image edit error: {e}")
+            return None
             
     # Keep for backward compatibility if needed, but we should migrate agents
     def get_client(self):
@@ -70,7 +147,7 @@ class OpenWebUIClient(BaseClient):
         self.model = config.OPENWEBUI_MODEL
         self.image_model = config.OPENWEBUI_IMAGE_MODEL
 
-    def generate_text(self, prompt: str, model: str = None) -> str:
+    def generate_text(self, prompt: str, model: str = None, schema: dict = None) -> str:
         url = f"{self.base_url}/chat/completions"
         selected_model = model or self.model
         
@@ -84,10 +161,10 @@ class OpenWebUIClient(BaseClient):
             for item in prompt:
                 if isinstance(item, str):
                     content.append({"type": "text", "text": item})
-                elif isinstance(item, Image.Image):
-                    buffered = io.BytesIO()
-                    item.save(buffered, format="PNG")
-                    img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
+                elif isinstance(item, (bytes, Image.Image)):
+                    # Encoded images are sent as-is, decoded ones are encoded to PNG first
+                    img_bytes = item if isinstance(item, bytes) else encode_image(item)
+                    img_str = base64.b64encode(img_bytes).decode("utf-8")
                     content.append({
                         "type": "image_url", 
                         "image_url": {"url": f"data:image/png;base64,{img_str}"}
@@ -99,6 +176,12 @@ class OpenWebUIClient(BaseClient):
             "messages": messages,
             "stream": False
         }
+        if schema:
+            # OpenAI-compatible structured outputs
+            data["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "response", "schema": schema}
+            }
         
         try:
             response = requests.post(url, json=data)
@@ -110,7 +193,7 @@ class OpenWebUIClient(BaseClient):
                 print(f"Response: {response.text}")
             return ""
 
-    def generate_image(self, prompt: str, model: str = None) -> Optional[Image.Image]:
+    def generate_image(self, prompt: str, model: str = None, size: str = None, steps: int = None) -> Optional[bytes]:
         url = f"{self.base_url}/images/generations"
         selected_model = model or self.image_model
         
@@ -118,37 +201,215 @@ class OpenWebUIClient(BaseClient):
             "model": selected_model,
             "prompt": prompt,
             "n": 1,
-            "size": "512x512" # Default, maybe configurable?
+            "size": size or "512x512"
         }
+        if steps:
+            data["steps"] = steps
         
         try:
             response = requests.post(url, json=data)
             response.raise_for_status()
+            return self._parse_image_response(response.json())
             
-            # OpenAI API returns url or b64_json
-            # LocalAI typically matches OpenAI
-            data = response.json()
-            if "data" in data and len(data["data"]) > 0:
-                img_data = data["data"][0]
-                if "url" in img_data:
-                    # Depending on setup, this URL might be local container URL.
-                    # Ideally we want b64_json if possible, or we fetch the URL.
-                    return Image.open(requests.get(img_data["url"], stream=True).raw)
-                if "b64_json" in img_data:
-                    return Image.open(io.BytesIO(base64.b64decode(img_data["b64_json"])))
-            
-            print(f"Unexpected image response format: {data}")
+        except Exception as e:
+            print(f"Open WebUI image generation error: {e}")
+            if 'response' in locals():
+                print(f"Response: {response.text}")
             return None
+
+    def effective_resolution(self, size: str = None, steps: int = None) -> tuple:
+        # Open WebUI samples with its configured image steps, the requested steps are not applied
+        return size or "512x512", None
+
+    def edit_image(self, prompt: str, image: bytes, model: str = None, size: str = None) -> Optional[bytes]:
+        # Served by the configured image edit workflow (e.g. workflows/flux2_klein_image_edit_base64.json)
+        url = f"{self.base_url}/images/edit"
+        selected_model = model or self.image_model
+        
+        img_str = base64.b64encode(image).decode("utf-8")
+        data = {
+            "model": selected_model,
+            "prompt": prompt,
+            "image": f"data:image/png;base64,{img_str}",
+            "n": 1
+        }
+        if size:
+            data["size"] = size
+        
+        try:
+            response = requests.post(url, json=data)
+            response.raise_for_status()
+            return self._parse_image_response(response.json())
             
         except Exception as e:
-            print(f"Open WebUI image generation error: {e}")
+            print(f"Open WebUI image edit error: {e}")
             if 'response' in locals():
                 print(f"Response: {response.text}")
             return None
 
+    def clear_vram(self, keep: str = None) -> None:
+        # Text model: ask Ollama to unload it immediately
+        if keep != "text" and config.OLLAMA_BASE_URL:
+            try:
+                response = requests.post(f"{config.OLLAMA_BASE_URL}/api/generate", json={"model": self.model, "keep_alive": 0})
+                response.raise_for_status()
+            except Exception as e:
+                print(f"Failed to unload text model: {e}")
+                
+        # Image model: queue the ComfyUI ClearVRAM workflow
+        if keep != "image" and config.COMFYUI_BASE_URL:
+            try:
+                with open(config.CLEAR_VRAM_WORKFLOW, "r") as f:
+                    workflow = json.load(f)
+                response = requests.post(f"{config.COMFYUI_BASE_URL}/prompt", json={"prompt": workflow})
+                response.raise_for_status()
+            except Exception as e:
+                print(f"Failed to clear image model VRAM: {e}")
+
+    def _parse_image_response(self, data) -> Optional[bytes]:
+        # OpenAI API returns url or b64_json
+        # LocalAI typically matches OpenAI
+        if isinstance(data, list):
+            data = {"data": data}
+        if "data" in data and len(data["data"]) > 0:
+            img_data = data["data"][0]
+            if "url" in img_data:
+                # Depending on setup, this URL might be local container URL.
+                # Ideally we want b64_json if possible, or we fetch the URL.
+                # The body is read fully so the connection is released right away.
+                image_response = requests.get(img_data["url"])
+                image_response.raise_for_status()
+                return to_png(image_response.content)
+            if "b64_json" in img_data:
+                return to_png(base64.b64decode(img_data["b64_json"]))
+        
+        print(f"Unexpected image response format: {data}")
+        return None
+
+class CassetteClient(BaseClient):
+    """
+    Records every request/response of a wrapped client to a cassette file ("record"),
+    or serves them back from the cassette without any model traffic ("replay").
+    The cassette is JSON lines (gzip-compressed if the path ends in .gz), images are stored as base64 PNG.
+    Identical requests are replayed in the order they were recorded.
+    """
+    def __init__(self, path: str, mode: str, client: BaseClient = None):
+        if mode not in ["record", "replay"]:
+            raise ValueError(f"Unknown cassette mode '{mode}', expected 'record' or 'replay'.")
+        if mode == "record" and client is None:
+            raise ValueError("Recording a cassette requires a client to wrap.")
+        self.path = path
+        self.mode = mode
+        self.client = client
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._responses = defaultdict(deque)
+        
+        if mode == "replay":
+            with self._open("rt") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._responses[entry["key"]].append(entry["response"])
+        else:
+            # Start a fresh cassette for this run
+            self._open("wt").close()
+
+    def generate_text(self, prompt: str, model: str = None, schema: dict = None) -> str:
+        request = {"prompt": self._describe(prompt), "model": model, "schema": schema}
+        if self.mode == "replay":
+            response = self._replay("generate_text", request)
+            return response if response is not None else ""
+        response = self.client.generate_text(prompt, model=model, schema=schema)
+        self._record("generate_text", request, response)
+        return response
+
+    def generate_image(self, prompt: str, model: str = None, size: str = None, steps: int = None) -> Optional[bytes]:
+        request = {"prompt": prompt, "model": model, "size": size, "steps": steps}
+        if self.mode == "replay":
+            return self._decode(self._replay("generate_image", request))
+        image = self.client.generate_image(prompt, model=model, size=size, steps=steps)
+        self._record("generate_image", request, self._encode(image))
+        return image
+
+    def edit_image(self, prompt: str, image: bytes, model: str = None, size: str = None) -> Optional[bytes]:
+        request = {"prompt": self._describe([prompt, image]), "model": model, "size": size}
+        if self.mode == "replay":
+            return self._decode(self._replay("edit_image", request))
+        edited = self.client.edit_image(prompt, image, model=model, size=size)
+        self._record("edit_image", request, self._encode(edited))
+        return edited
+
+    def effective_resolution(self, size: str = None, steps: int = None) -> tuple:
+        # Recorded as well, so a replay makes the same decisions as the recorded run
+        request = {"size": size, "steps": steps}
+        if self.mode == "replay":
+            response = self._replay("effective_resolution", request)
+            return tuple(response) if response is not None else (size, steps)
+        response = self.client.effective_resolution(size, steps)
+        self._record("effective_resolution", request, list(response))
+        return response
+
+    def clear_vram(self, keep: str = None) -> None:
+        if self.mode == "record":
+            self.client.clear_vram(keep=keep)
+
+    def _describe(self, prompt):
+        # Images are identified by the digest of their encoded bytes
+        if not isinstance(prompt, list):
+            return prompt
+        parts = []
+        for item in prompt:
+            if isinstance(item, Image.Image):
+                item = encode_image(item)
+            if isinstance(item, bytes):
+                item = {"image_sha256": hashlib.sha256(item).hexdigest()}
+            parts.append(item)
+        return parts
+
+    def _key(self, method: str, request: dict) -> str:
+        payload = json.dumps({"method": method, **request}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _record(self, method: str, request: dict, response) -> None:
+        entry = {"key": self._key(method, request), "method": method, "request": request, "response": response}
+        with self._lock:
+            with self._open("at") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+
+    def _replay(self, method: str, request: dict):
+        key = self._key(method, request)
+        with self._lock:
+            responses = self._responses.get(key)
+            if not responses:
+                self.misses += 1
+                print(f"Cassette miss for {method} (no recorded response for this request).")
+                return None
+            # The last recorded response keeps serving once a request is replayed more often than recorded
+            return responses.popleft() if len(responses) > 1 else responses[0]
+
+    def _encode(self, image: Optional[bytes]):
+        return base64.b64encode(image).decode("utf-8") if image else None
+
+    def _decode(self, data) -> Optional[bytes]:
+        return base64.b64decode(data) if data else None
+
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode, encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
 def get_client() -> BaseClient:
+    if config.CASSETTE_MODE == "replay":
+        # Served entirely from the cassette, no backend client needed
+        return CassetteClient(config.CASSETTE_PATH, "replay")
+        
     if config.LLM_BACKEND == "open-web-ui":
-        return OpenWebUIClient()
-    return GeminiClient()
+        client = OpenWebUIClient()
+    else:
+        client = GeminiClient()
+        
+    if config.CASSETTE_MODE == "record":
+        return CassetteClient(config.CASSETTE_PATH, "record", client)
+    return client
 
 client_instance = get_client()
@@ -22,12 +22,22 @@ class Config:
         self.GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", file_config.get("GOOGLE_API_KEY"))
         self.VLM_MODEL = os.getenv("VLM_MODEL", file_config.get("VLM_MODEL", "gemini-3-pro-latest")) # upgraded default for better reasoning
         self.IMAGE_MODEL = os.getenv("IMAGE_MODEL", file_config.get("IMAGE_MODEL", "imagen-3.0-generate-001"))
+        self.EDIT_MODEL = os.getenv("EDIT_MODEL", file_config.get("EDIT_MODEL", "gemini-2.5-flash-image")) # used for the hybrid polish pass
         
         # Paths
         self.OUTPUT_DIR = os.getenv("OUTPUT_DIR", file_config.get("OUTPUT_DIR", "outputs"))
         
         # Pipeline settings
         self.DEFAULT_ITERATIONS = int(os.getenv("DEFAULT_ITERATIONS", file_config.get("DEFAULT_ITERATIONS", 3)))
+        self.BATCH_SCHEDULING = os.getenv("BATCH_SCHEDULING", file_config.get("BATCH_SCHEDULING", "parallel")) # "parallel" or "phased"
+        # Resolution ladder as "WIDTHxHEIGHT:STEPS": draft iterations only need to show layout and content,
+        # the last accepted draft can be re-rendered once at the final resolution by the image-edit model
+        self.IMAGE_RESOLUTION_LADDER = self._get_list("IMAGE_RESOLUTION_LADDER", file_config, ["384x384:4", "512x512:8"])
+        self.FINAL_IMAGE_RESOLUTION = os.getenv("FINAL_IMAGE_RESOLUTION", file_config.get("FINAL_IMAGE_RESOLUTION", "")) # e.g. "1024x1024", off by default
+        # Critiques of near-identical images (perceptual hash distance <= threshold bits out of 256) are reused
+        self.CRITIQUE_CACHE_ENABLED = str(os.getenv("CRITIQUE_CACHE_ENABLED", file_config.get("CRITIQUE_CACHE_ENABLED", True))).lower() in ["1", "true", "yes"]
+        self.CRITIQUE_CACHE_THRESHOLD = int(os.getenv("CRITIQUE_CACHE_THRESHOLD", file_config.get("CRITIQUE_CACHE_THRESHOLD", 8)))
+        self.IMAGE_MEMORY_LIMIT_MB = int(os.getenv("IMAGE_MEMORY_LIMIT_MB", file_config.get("IMAGE_MEMORY_LIMIT_MB", 256))) # cap on encoded images kept in memory
 
         # LLM Backend
         self.LLM_BACKEND = os.getenv("LLM_BACKEND", file_config.get("LLM_BACKEND", "gemini")) # "gemini" or "ollama"
@@ -36,11 +46,31 @@ class Config:
         self.OPENWEBUI_BASE_URL = os.getenv("OPENWEBUI_BASE_URL", file_config.get("OPENWEBUI_BASE_URL", "https://ai-lab.tail8befb3.ts.net/api"))
         self.OPENWEBUI_MODEL = os.getenv("OPENWEBUI_MODEL", file_config.get("OPENWEBUI_MODEL", "gemma:12b"))
         self.OPENWEBUI_IMAGE_MODEL = os.getenv("OPENWEBUI_IMAGE_MODEL", file_config.get("OPENWEBUI_IMAGE_MODEL", "flux-2-klein-4b"))
+        
+        # VRAM management between text and image phases (optional, used by phased batch scheduling)
+        self.OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", file_config.get("OLLAMA_BASE_URL"))
+        self.COMFYUI_BASE_URL = os.getenv("COMFYUI_BASE_URL", file_config.get("COMFYUI_BASE_URL"))
+        self.CLEAR_VRAM_WORKFLOW = os.getenv("CLEAR_VRAM_WORKFLOW", file_config.get("CLEAR_VRAM_WORKFLOW", "workflows/ClearVRAM.json"))
+
 
 
+        # Record/replay of model traffic
+        self.CASSETTE_MODE = os.getenv("CASSETTE_MODE", file_config.get("CASSETTE_MODE")) # None, "record" or "replay"
+        self.CASSETTE_PATH = os.getenv("CASSETTE_PATH", file_config.get("CASSETTE_PATH", "cassette.jsonl.gz"))
 
         # Draw.io settings
         self.DRAWIO_PATH = os.getenv("DRAWIO_PATH", file_config.get("DRAWIO_PATH"))
-        self.OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", file_config.get("OUTPUT_FORMAT", "image")) # "image" or "drawio"
+        self.OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", file_config.get("OUTPUT_FORMAT", "image")) # "image", "drawio" or "hybrid"
+        self.DRAWIO_LAYOUT = os.getenv("DRAWIO_LAYOUT", file_config.get("DRAWIO_LAYOUT", "auto")) # "auto" (only on overlaps), "always" or "off"
+        self.DRAWIO_LAYOUT_DIRECTION = os.getenv("DRAWIO_LAYOUT_DIRECTION", file_config.get("DRAWIO_LAYOUT_DIRECTION", "TB")) # "TB" or "LR"
+        self.EXPORT_FORMATS = self._get_list("EXPORT_FORMATS", file_config, ["png", "svg", "pdf"]) # final Draw.io export formats
+        self.EXPORT_SCALES = [float(scale) for scale in self._get_list("EXPORT_SCALES", file_config, [1])]
+
+    def _get_list(self, key, file_config, default):
+        # Lists come from config.json as JSON arrays or from the environment as comma-separated values
+        value = os.getenv(key)
+        if value is not None:
+            return [item.strip() for item in value.split(",") if item.strip()]
+        return file_config.get(key, default)
 
 config = Config()
@@ -0,0 +1,110 @@
+from collections import OrderedDict
+from PIL import Image
+import io
+import threading
+from .config import config
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def encode_image(image: Image.Image, format: str = "PNG") -> bytes:
+    buffered = io.BytesIO()
+    image.save(buffered, format=format)
+    return buffered.getvalue()
+
+def decode_image(data: bytes) -> Image.Image:
+    """Decodes image bytes eagerly so no file handle or socket stays attached to the image."""
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+def to_png(data: bytes) -> bytes:
+    """Returns encoded image bytes as PNG. PNG data is passed through, only other formats (e.g. JPEG or WebP) are re-encoded."""
+    if data.startswith(PNG_SIGNATURE):
+        return data
+    with Image.open(io.BytesIO(data)) as image:
+        return encode_image(image)
+
+def perceptual_hash(data: bytes, hash_size: int = 8) -> int:
+    """
+    Difference hash (dHash) of an encoded image: compares neighbouring pixels of a small grayscale thumbnail.
+    Visually near-identical images get hashes within a small Hamming distance.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        thumbnail = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = thumbnail.tobytes()
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+class ImageArtifact:
+    """An image persisted to disk and kept in memory as encoded PNG bytes, decoded only on demand."""
+    def __init__(self, path: str, data: bytes = None):
+        self.path = path
+        self._data = data
+
+    @property
+    def resident_bytes(self) -> int:
+        return len(self._data) if self._data is not None else 0
+
+    def data(self) -> bytes:
+        if self._data is not None:
+            return self._data
+        # Spilled artifacts are read back from disk
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def open(self) -> Image.Image:
+        return decode_image(self.data())
+
+    def release(self) -> None:
+        self._data = None
+
+class ImageStore:
+    """Tracks resident encoded images and spills the oldest ones to disk once the memory cap is exceeded."""
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self._artifacts = OrderedDict()
+        self._resident_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def resident_bytes(self) -> int:
+        return self._resident_bytes
+
+    def put(self, image: Image.Image, path: str) -> ImageArtifact:
+        """Encodes and saves a decoded image. The caller can close the image afterwards."""
+        return self.put_bytes(encode_image(image), path)
+
+    def put_bytes(self, data: bytes, path: str) -> ImageArtifact:
+        """Saves encoded PNG bytes as they are, e.g. an image returned by a client, without decoding them."""
+        with open(path, "wb") as f:
+            f.write(data)
+        return self._track(ImageArtifact(path, data))
+
+    def load(self, path: str) -> ImageArtifact:
+        """Wraps an image file written by another process (e.g. a Draw.io render)."""
+        with open(path, "rb") as f:
+            data = f.read()
+        return self._track(ImageArtifact(path, data))
+
+    def release(self, artifact: ImageArtifact) -> None:
+        with self._lock:
+            if self._artifacts.pop(id(artifact), None) is not None:
+                self._resident_bytes -= artifact.resident_bytes
+            artifact.release()
+
+    def _track(self, artifact: ImageArtifact) -> ImageArtifact:
+        with self._lock:
+            self._artifacts[id(artifact)] = artifact
+            self._resident_bytes += artifact.resident_bytes
+            while self._resident_bytes > self.limit_bytes and self._artifacts:
+                _, oldest = self._artifacts.popitem(last=False)
+                self._resident_bytes -= oldest.resident_bytes
+                oldest.release()
+        return artifact
+
+image_store = ImageStore(config.IMAGE_MEMORY_LIMIT_MB * 1024 * 1024)
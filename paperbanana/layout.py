@@ -0,0 +1,413 @@
+import hashlib
+import re
+import xml.etree.ElementTree as ET
+
+# Elements that wrap an mxCell and carry its id (used for custom properties/links)
+WRAPPER_TAGS = ("UserObject", "object")
+
+DEFAULT_WIDTH = 120
+DEFAULT_HEIGHT = 60
+FRAME_PADDING = 20
+FRAME_LABEL_PADDING = 30
+
+def repair_xml(xml: str) -> tuple[str, list[str]]:
+    """
+    Validates LLM-generated mxGraph XML and repairs common defects before rendering:
+    surrounding chatter, unescaped ampersands, missing root cells, missing or duplicate ids,
+    dangling parents and edge endpoints, and vertices without geometry.
+    Returns the repaired XML and a list of the issues found. XML that cannot be parsed is returned unchanged.
+    """
+    issues = []
+
+    # Keep only the diagram itself
+    match = re.search(r"<(mxfile|mxGraphModel)\b.*</\1>", xml, re.DOTALL)
+    if not match:
+        return xml, ["No mxfile or mxGraphModel element found."]
+    if match.group(0) != xml.strip():
+        issues.append("Removed text surrounding the diagram XML.")
+    xml = match.group(0)
+
+    try:
+        tree = ET.fromstring(xml)
+    except ET.ParseError:
+        escaped = re.sub(r"&(?!amp;|lt;|gt;|quot;|apos;|#)", "&amp;", xml)
+        try:
+            tree = ET.fromstring(escaped)
+            issues.append("Escaped stray '&' characters.")
+        except ET.ParseError as e:
+            return xml, issues + [f"XML is not well-formed: {e}"]
+
+    model = tree if tree.tag == "mxGraphModel" else tree.find(".//mxGraphModel")
+    if model is None:
+        # e.g. compressed <diagram> content, which is left to Draw.io
+        return ET.tostring(tree, encoding="unicode"), issues
+
+    root = model.find("root")
+    if root is None:
+        root = ET.SubElement(model, "root")
+        issues.append("Added missing <root> element.")
+
+    cells = _cells(root)
+    ids = set()
+    for element, cell in cells:
+        cell_id = element.get("id")
+        if not cell_id:
+            cell_id = _unique_id("cell", ids)
+            element.set("id", cell_id)
+            issues.append(f"Assigned id '{cell_id}' to a cell without id.")
+        elif cell_id in ids:
+            new_id = _unique_id(cell_id, ids)
+            element.set("id", new_id)
+            issues.append(f"Renamed duplicate id '{cell_id}' to '{new_id}'.")
+            cell_id = new_id
+        ids.add(cell_id)
+
+    if "0" not in ids:
+        root.insert(0, ET.Element("mxCell", {"id": "0"}))
+        ids.add("0")
+        issues.append("Added missing root cell '0'.")
+    if "1" not in ids:
+        root.insert(1, ET.Element("mxCell", {"id": "1", "parent": "0"}))
+        ids.add("1")
+        issues.append("Added missing default layer cell '1'.")
+
+    removed = set()
+    for element, cell in _cells(root):
+        cell_id = element.get("id")
+        if cell_id == "0":
+            continue
+        parent = cell.get("parent")
+        if parent not in ids or parent == cell_id:
+            cell.set("parent", "1")
+            issues.append(f"Re-parented cell '{cell_id}' with missing parent '{parent}' to the default layer.")
+
+        if cell.get("edge") == "1":
+            dangling = [end for end in ("source", "target") if cell.get(end) and cell.get(end) not in ids]
+            if dangling:
+                root.remove(element)
+                removed.add(cell_id)
+                issues.append(f"Removed edge '{cell_id}' with dangling {' and '.join(dangling)}.")
+        elif cell.get("vertex") == "1" and cell.find("mxGeometry") is None:
+            ET.SubElement(cell, "mxGeometry", {"width": str(DEFAULT_WIDTH), "height": str(DEFAULT_HEIGHT), "as": "geometry"})
+            issues.append(f"Added missing geometry to vertex '{cell_id}'.")
+
+    # Cells inside removed edges (e.g. edge labels) and edges attached to them go as well
+    while removed:
+        orphans = [
+            (element, cell) for element, cell in _cells(root)
+            if cell.get("parent") in removed or cell.get("source") in removed or cell.get("target") in removed
+        ]
+        removed = set()
+        for element, cell in orphans:
+            root.remove(element)
+            removed.add(element.get("id"))
+            issues.append(f"Removed cell '{element.get('id')}' attached to a removed cell.")
+
+    return ET.tostring(tree, encoding="unicode"), issues
+
+def has_overlaps(xml: str) -> bool:
+    """Checks whether any top-level vertices partially overlap. Full containment (e.g. panels) is not an overlap."""
+    graph = _parse_graph(xml)
+    if graph is None:
+        return False
+    boxes = list(graph["boxes"].values())
+    for i, a in enumerate(boxes):
+        for b in boxes[i + 1:]:
+            if _intersects(a, b) and not _contains(a, b) and not _contains(b, a):
+                return True
+    return False
+
+def structure_fingerprint(xml: str) -> str:
+    """
+    Digest of what a diagram shows apart from its geometry: labels, styles, nesting and edge topology.
+    Diagrams that only differ in coordinates, sizes or cell ids get the same fingerprint.
+    """
+    graph = _parse_graph(xml)
+    if graph is None:
+        return hashlib.sha256(xml.encode("utf-8")).hexdigest()
+    model = graph["tree"] if graph["tree"].tag == "mxGraphModel" else graph["tree"].find(".//mxGraphModel")
+    elements = {element.get("id"): (element, cell) for element, cell in _cells(model.find("root"))}
+
+    def describe(cell_id):
+        # Cells are identified by their content, ids are regenerated with every build
+        element, cell = elements.get(cell_id, (None, None))
+        if cell is None:
+            return ""
+        label = element.get("label") if element is not cell else cell.get("value")
+        return f"{label or ''}|{cell.get('style') or ''}"
+
+    entries = sorted(
+        "\0".join([
+            "edge" if cell.get("edge") == "1" else "vertex" if cell.get("vertex") == "1" else "cell",
+            describe(cell_id), describe(cell.get("parent")), describe(cell.get("source")), describe(cell.get("target")),
+        ])
+        for cell_id, (element, cell) in elements.items()
+    )
+    return hashlib.sha256("\n".join(entries).encode("utf-8")).hexdigest()
+
+def layered_layout(xml: str, direction: str = "TB", rank_spacing: int = 80, node_spacing: int = 40) -> str:
+    """
+    Computes a layered (Sugiyama-style) layout for the top-level vertices of a diagram:
+    cycles are broken, vertices are assigned to layers by longest path, ordered within layers
+    by barycenter sweeps to reduce crossings, and placed top-to-bottom ("TB") or left-to-right ("LR").
+    Containers (swimlane, group or container=1 styles) and vertices enclosing several others (e.g. panels)
+    are frames: their members are laid out first, then the frame is fitted around them, never below its
+    original size, and placed as a single vertex, so edges to a frame take part in the layering.
+    A vertex enclosing a single other vertex (e.g. a shape with a text vertex on top) is one node
+    and the enclosed vertex moves with it. Stale edge waypoints are dropped. Vertex sizes are kept.
+    """
+    graph = _parse_graph(xml)
+    if graph is None or not graph["boxes"]:
+        return xml
+    tree, cells, boxes = graph["tree"], graph["cells"], graph["boxes"]
+    original = dict(boxes)
+    area = lambda vid: original[vid][2] * original[vid][3]
+
+    frames, attached = {}, {}
+    for frame_id, frame in boxes.items():
+        members = [vid for vid, box in boxes.items() if vid != frame_id and _contains(frame, box)]
+        if members and (_is_container(cells[frame_id]) or len(members) > 1):
+            frames[frame_id] = members
+        elif members:
+            attached[members[0]] = frame_id
+
+    # Every vertex belongs to its innermost frame only, enclosed vertices follow their host instead
+    owner = {}
+    for frame_id in sorted(frames, key=area, reverse=True):
+        for vid in frames[frame_id]:
+            if vid not in attached:
+                owner[vid] = frame_id
+    children = {frame_id: [] for frame_id in frames}
+    for vid, frame_id in owner.items():
+        children[frame_id].append(vid)
+    # A frame whose members all belong to another (partly overlapping) frame is laid out as a plain vertex
+    for frame_id in [frame_id for frame_id, members in children.items() if not members]:
+        del frames[frame_id], children[frame_id]
+
+    def followers(vid):
+        # Vertices moving along when a vertex is placed
+        moved = [other for other, host in attached.items() if host == vid]
+        for child in children.get(vid, []):
+            moved += [child] + followers(child)
+        return moved
+
+    # Edges attached to nested cells or enclosed vertices are attributed to the vertex laid out
+    edges = []
+    for cell in cells.values():
+        if cell.get("edge") == "1":
+            source, target = (graph["top_level"].get(cell.get(end)) for end in ("source", "target"))
+            edges.append((attached.get(source, source), attached.get(target, target)))
+
+    across = 0 if direction == "TB" else 1
+    along = 1 - across
+    size = lambda vid: (boxes[vid][2], boxes[vid][3])
+
+    def place(items: list) -> None:
+        # Lays out one level of vertices, edges to vertices inside a frame count for the frame
+        item_set = set(items)
+        def lift(vid):
+            while vid is not None and vid not in item_set:
+                vid = owner.get(vid)
+            return vid
+
+        # Sort within layers by the original position across the flow direction
+        items = sorted(items, key=lambda vid: (boxes[vid][across], boxes[vid][along]))
+        successors = {vid: [] for vid in items}
+        for source, target in edges:
+            source, target = lift(source), lift(target)
+            if source is not None and target is not None and source != target and target not in successors[source]:
+                successors[source].append(target)
+
+        successors = _break_cycles(items, successors)
+        layers = _assign_layers(items, successors)
+        _order_layers(layers, successors)
+
+        # Place layers along the flow direction, centering each layer across it
+        layer_extents = [sum(size(vid)[across] for vid in layer) + node_spacing * (len(layer) - 1) for layer in layers]
+        widest = max(layer_extents)
+        origin = [min(boxes[vid][0] for vid in items), min(boxes[vid][1] for vid in items)]
+
+        position_along = origin[along]
+        for layer, extent in zip(layers, layer_extents):
+            position_across = origin[across] + (widest - extent) / 2
+            depth = max(size(vid)[along] for vid in layer)
+            for vid in layer:
+                x, y, w, h = boxes[vid]
+                coords = [0, 0]
+                coords[across] = position_across
+                coords[along] = position_along + (depth - size(vid)[along]) / 2
+                boxes[vid] = (coords[0], coords[1], w, h)
+                for other in followers(vid):
+                    ox, oy, ow, oh = boxes[other]
+                    boxes[other] = (ox + coords[0] - x, oy + coords[1] - y, ow, oh)
+                position_across += size(vid)[across] + node_spacing
+            position_along += depth + rank_spacing
+
+    # Frames innermost first: lay out the members, then fit the frame around them
+    for frame_id in sorted(frames, key=area):
+        place(children[frame_id])
+        member_boxes = [boxes[vid] for vid in children[frame_id]]
+        left = min(box[0] for box in member_boxes) - FRAME_PADDING
+        top = min(box[1] for box in member_boxes) - FRAME_LABEL_PADDING
+        right = max(box[0] + box[2] for box in member_boxes) + FRAME_PADDING
+        bottom = max(box[1] + box[3] for box in member_boxes) + FRAME_PADDING
+        boxes[frame_id] = (left, top, max(right - left, original[frame_id][2]), max(bottom - top, original[frame_id][3]))
+    place([vid for vid in boxes if vid not in owner and vid not in attached])
+
+    for vid, (x, y, w, h) in boxes.items():
+        geometry = cells[vid].find("mxGeometry")
+        geometry.set("x", _format(x))
+        geometry.set("y", _format(y))
+        geometry.set("width", _format(w))
+        geometry.set("height", _format(h))
+
+    for cell in cells.values():
+        geometry = cell.find("mxGeometry")
+        if cell.get("edge") == "1" and geometry is not None:
+            for points in geometry.findall("Array[@as='points']"):
+                geometry.remove(points)
+
+    return ET.tostring(tree, encoding="unicode")
+
+def _cells(root) -> list:
+    # Returns (element carrying the id, mxCell) pairs for the direct children of <root>
+    cells = []
+    for element in list(root):
+        if element.tag in WRAPPER_TAGS:
+            cell = element.find("mxCell")
+            if cell is not None:
+                cells.append((element, cell))
+        elif element.tag == "mxCell":
+            cells.append((element, element))
+    return cells
+
+def _unique_id(base: str, ids: set) -> str:
+    n = 1
+    while f"{base}_{n}" in ids:
+        n += 1
+    return f"{base}_{n}"
+
+def _parse_graph(xml: str):
+    try:
+        tree = ET.fromstring(xml)
+    except ET.ParseError:
+        return None
+    model = tree if tree.tag == "mxGraphModel" else tree.find(".//mxGraphModel")
+    root = model.find("root") if model is not None else None
+    if root is None:
+        return None
+
+    cells = {element.get("id"): cell for element, cell in _cells(root) if element.get("id")}
+    parents = {cid: cell.get("parent") for cid, cell in cells.items()}
+    # Layers are the cells directly below the root cell
+    layers = {cid for cid, parent in parents.items() if parent is not None and parents.get(parent) is None}
+
+    # Edges attached to nested cells are attributed to their top-level vertex
+    top_level = {}
+    for cid in cells:
+        ancestor, seen = cid, {cid}
+        while parents.get(ancestor) in cells and parents[ancestor] not in layers and parents[ancestor] not in seen:
+            ancestor = parents[ancestor]
+            seen.add(ancestor)
+        top_level[cid] = ancestor
+
+    boxes = {}
+    for cid, cell in cells.items():
+        geometry = cell.find("mxGeometry")
+        if cell.get("vertex") == "1" and parents[cid] in layers and geometry is not None:
+            boxes[cid] = (
+                _number(geometry.get("x"), 0),
+                _number(geometry.get("y"), 0),
+                _number(geometry.get("width"), DEFAULT_WIDTH),
+                _number(geometry.get("height"), DEFAULT_HEIGHT),
+            )
+    return {"tree": tree, "cells": cells, "boxes": boxes, "top_level": top_level}
+
+def _break_cycles(nodes: list, successors: dict) -> dict:
+    # Depth-first search, reversing back edges so the graph becomes acyclic
+    acyclic = {vid: [] for vid in nodes}
+    state = {}
+    for start in nodes:
+        if start in state:
+            continue
+        state[start] = "active"
+        stack = [(start, iter(successors[start]))]
+        while stack:
+            vid, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                state[vid] = "done"
+                stack.pop()
+            elif state.get(child) == "active":
+                if vid not in acyclic[child]:
+                    acyclic[child].append(vid)
+            else:
+                acyclic[vid].append(child)
+                if child not in state:
+                    state[child] = "active"
+                    stack.append((child, iter(successors[child])))
+    return acyclic
+
+def _assign_layers(nodes: list, successors: dict) -> list:
+    # Longest path layering in topological order
+    indegree = {vid: 0 for vid in nodes}
+    for vid in nodes:
+        for child in successors[vid]:
+            indegree[child] += 1
+    rank = {vid: 0 for vid in nodes}
+    queue = [vid for vid in nodes if indegree[vid] == 0]
+    while queue:
+        vid = queue.pop(0)
+        for child in successors[vid]:
+            rank[child] = max(rank[child], rank[vid] + 1)
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                queue.append(child)
+    layers = [[] for _ in range(max(rank.values()) + 1)]
+    for vid in nodes:
+        layers[rank[vid]].append(vid)
+    return layers
+
+def _order_layers(layers: list, successors: dict, sweeps: int = 4) -> None:
+    # Barycenter heuristic, alternating downward and upward sweeps
+    predecessors = {vid: [] for layer in layers for vid in layer}
+    for vid, children in successors.items():
+        for child in children:
+            predecessors[child].append(vid)
+
+    for sweep in range(sweeps):
+        downward = sweep % 2 == 0
+        indices = range(1, len(layers)) if downward else range(len(layers) - 2, -1, -1)
+        for i in indices:
+            reference = layers[i - 1] if downward else layers[i + 1]
+            position = {vid: p for p, vid in enumerate(reference)}
+            neighbours = predecessors if downward else successors
+
+            def barycenter(item):
+                p, vid = item
+                linked = [position[n] for n in neighbours[vid] if n in position]
+                return sum(linked) / len(linked) if linked else p
+
+            layers[i] = [vid for _, vid in sorted(enumerate(layers[i]), key=barycenter)]
+
+def _is_container(cell) -> bool:
+    entries = [entry.strip() for entry in (cell.get("style") or "").split(";")]
+    return any(entry in ("swimlane", "group", "container=1", "shape=swimlane") for entry in entries)
+
+def _intersects(a: tuple, b: tuple) -> bool:
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+def _contains(outer: tuple, inner: tuple) -> bool:
+    # Strictly larger, so identical boxes count as overlapping rather than framing each other
+    return (outer[0] <= inner[0] and outer[1] <= inner[1]
+            and inner[0] + inner[2] <= outer[0] + outer[2] and inner[1] + inner[3] <= outer[1] + outer[3]
+            and outer[2] * outer[3] > inner[2] * inner[3])
+
+def _number(value, default: float) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def _format(value: float) -> str:
+    return f"{value:g}"
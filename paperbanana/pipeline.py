@@ -1,7 +1,16 @@
-from .agents import Retriever, Planner, Stylist, Visualizer, Critic, SketchGenerator, DrawIOBuilder, Renderer, DiagramCritic
+from .agents import Retriever, Planner, Stylist, Visualizer, Critic, SketchGenerator, DrawIOBuilder, Renderer, DiagramCritic, Polisher, LayoutEngine
 from .config import config
+from .images import image_store
+from .cache import critique_cache
+from .scheduler import PhaseScheduler
+from functools import partial
 import os
 
+def parse_resolution(resolution: str) -> tuple:
+    """Parses a "WIDTHxHEIGHT:STEPS" resolution setting into (size, steps). Steps are optional."""
+    size, _, steps = resolution.partition(":")
+    return size, int(steps) if steps else None
+
 class Pipeline:
     def __init__(self, iterations=config.DEFAULT_ITERATIONS):
         self.iterations = iterations
@@ -13,10 +22,12 @@ class Pipeline:
         self.critic = Critic()
         self.sketch_generator = SketchGenerator()
         self.drawio_builder = DrawIOBuilder()
+        self.layout_engine = LayoutEngine()
         self.renderer = Renderer()
         self.diagram_critic = DiagramCritic()
+        self.polisher = Polisher()
 
-    def generate(self, input_text: str) -> None:
+    def generate(self, input_text: str, output_dir: str = None) -> None:
         """
         Orchestrates the generation process:
         1. Retrieval
@@ -25,6 +36,11 @@ class Pipeline:
         4. Visualization (Image or Draw.io)
         5. Iterative Refinement
         """
+        current_description = self._plan(input_text)
+        
+        self._generate_output(input_text, current_description, output_dir or config.OUTPUT_DIR)
+
+    def _plan(self, input_text: str) -> str:
         print("Gathering reference examples...")
         examples = self.retriever.retrieve(input_text)
         
@@ -34,68 +50,131 @@ class Pipeline:
         print("Styling the plan...")
         styled_plan = self.stylist.style(initial_plan)
         
-        current_description = styled_plan
-        
+        return styled_plan
+
+    def _generate_output(self, input_text: str, current_description: str, output_dir: str):
         # Branch based on output format
         if config.OUTPUT_FORMAT == 'drawio':
-            self._generate_drawio(input_text, current_description)
+            self._generate_drawio(input_text, current_description, output_dir)
+        elif config.OUTPUT_FORMAT == 'hybrid':
+            self._generate_hybrid(input_text, current_description, output_dir)
         else:
-            self._generate_image(input_text, current_description)
+            self._generate_image(input_text, current_description, output_dir)
 
-    def _generate_image(self, input_text: str, current_description: str):
+    def _generate_image(self, input_text: str, current_description: str, output_dir: str):
+        artifact = None
         for i in range(self.iterations):
             print(f"Iteration {i+1}/{self.iterations}...")
             
-            # Generate Image
-            image = self.visualizer.visualize(current_description)
-            if image:
-                image.save(f"{config.OUTPUT_DIR}/iteration_{i+1}.png")
-                print(f"Saved iteration_{i+1}.png")
-            else:
-                print("Failed to generate image.")
+            artifact = self._visualize(current_description, output_dir, i)
+            if not artifact:
+                # A failed draft ends the run without a final pass, as in _generate_batch_phased
+                print("Skipping final image after a failed iteration.")
                 break
             
-            # Critique
-            print("Critiquing...")
-            critique_result = self.critic.critique(image, input_text, current_description)
+            current_description = self._critique(artifact, input_text, current_description)
             
-            suggestions = critique_result.get("critic_suggestions", "No suggestions")
-            refined_description = critique_result.get("revised_description", current_description)
+        else:
+            self._finalize(current_description, output_dir, artifact)
             
-            print(f"Critique: {suggestions}")
+        print("Generation complete (Image).")
+
+    def _visualize(self, current_description: str, output_dir: str, i: int):
+        # Generate Image, drafts climb the resolution ladder as iterations progress
+        size, steps = self._draft_resolution(i)
+        image = self.visualizer.visualize(current_description, size=size, steps=steps)
+        if not image:
+            print("Failed to generate image.")
+            return None
             
-            # Update Plan
-            current_description = refined_description
+        # The encoded bytes from the backend are stored as they are, the image is never decoded here
+        artifact = image_store.put_bytes(image, f"{output_dir}/iteration_{i+1}.png")
+        print(f"Saved iteration_{i+1}.png")
+        return artifact
+
+    def _draft_resolution(self, i: int) -> tuple:
+        ladder = config.IMAGE_RESOLUTION_LADDER
+        if not ladder:
+            return None, None
+        return parse_resolution(ladder[min(i, len(ladder) - 1)])
+
+    def _finalize(self, current_description: str, output_dir: str, draft):
+        """
+        Re-renders the last accepted draft once at publication resolution with the image-edit model,
+        so the final image keeps the composition the critic reviewed. Off unless FINAL_IMAGE_RESOLUTION is set.
+        """
+        if not config.FINAL_IMAGE_RESOLUTION or not draft:
+            return
             
-        print("Generation complete (Image).")
+        size, _ = parse_resolution(config.FINAL_IMAGE_RESOLUTION)
+        # Skip a pass the backend would render at the size of the last draft
+        # (e.g. FINAL_IMAGE_RESOLUTION equal to the last rung, or Imagen serving both at 1K)
+        last_size, _ = self._draft_resolution(self.iterations - 1)
+        if self.visualizer.resolution(size)[0] == self.visualizer.resolution(last_size)[0]:
+            print(f"Final resolution matches the last draft, iteration_{self.iterations}.png is the final image.")
+            return
+            
+        print(f"Rendering final image at {size} from the last draft...")
+        image = self.visualizer.finalize(draft.data(), current_description, size=size)
+        if not image:
+            print("Failed to generate final image.")
+            return
+            
+        artifact = image_store.put_bytes(image, f"{output_dir}/final.png")
+        image_store.release(artifact)
+        print("Saved final.png")
 
-    def _generate_drawio(self, input_text: str, current_description: str):
-        print("Starting Draw.io generation workflow...")
+    def _critique(self, artifact, input_text: str, current_description: str) -> str:
+        # Critique
+        print("Critiquing...")
+        critique_result = self.critic.critique(artifact.data(), input_text, current_description)
+        image_store.release(artifact)
+        
+        suggestions = critique_result.get("critic_suggestions", "No suggestions")
+        refined_description = critique_result.get("revised_description", current_description)
         
+        print(f"Critique: {suggestions}")
+        
+        # Update Plan
+        return refined_description
+
+    def _generate_drawio(self, input_text: str, current_description: str, output_dir: str) -> tuple:
+        print("Starting Draw.io generation workflow...")
+        sketch_artifact = self._sketch(current_description, output_dir)
+        return self._build_drawio(input_text, current_description, output_dir, sketch_artifact)
+
+    def _sketch(self, current_description: str, output_dir: str):
         # 1. Generate Sketch (Prototype)
         print("Generating prototype sketch...")
-        sketch = self.sketch_generator.sketch(current_description)
-        if sketch:
-            sketch.save(f"{config.OUTPUT_DIR}/sketch_prototype.png")
-            print("Saved sketch_prototype.png")
-        else:
+        # The sketch only guides layout, so it is drawn at the lowest draft resolution
+        size, steps = self._draft_resolution(0)
+        sketch = self.sketch_generator.sketch(current_description, size=size, steps=steps)
+        if not sketch:
             print("Failed to generate sketch.")
             # Continue anyway, relying on text description
-        
+            return None
+            
+        sketch_artifact = image_store.put_bytes(sketch, f"{output_dir}/sketch_prototype.png")
+        print("Saved sketch_prototype.png")
+        return sketch_artifact
+
+    def _build_drawio(self, input_text: str, current_description: str, output_dir: str, sketch_artifact) -> tuple:
+        """Builds and refines the Draw.io diagram. Returns the final .drawio path and the description refined on the sketch."""
         # 2. Critique Sketch (Visual Concept)
         print("Critiquing sketch...")
         # We use the standard Critic here to refine the description based on the sketch
-        if sketch:
-            critique_result = self.critic.critique(sketch, input_text, current_description)
+        if sketch_artifact:
+            critique_result = self.critic.critique(sketch_artifact.data(), input_text, current_description)
+            image_store.release(sketch_artifact)
             current_description = critique_result.get("revised_description", current_description)
             print(f"Refined description based on sketch: {critique_result.get('critic_suggestions')}")
 
         # 3. Build Draw.io XML
         print("Building Draw.io XML...")
-        xml_content = self.drawio_builder.build(current_description)
+        xml_content = self.layout_engine.process(self.drawio_builder.build(current_description))
         
         # Save initial XML
-        with open(f"{config.OUTPUT_DIR}/diagram_v0.drawio", "w") as f:
+        with open(f"{output_dir}/diagram_v0.drawio", "w") as f:
             f.write(xml_content)
             
         # 4. Iterative Refinement of XML
@@ -103,8 +182,8 @@ class Pipeline:
             print(f"Draw.io Iteration {i+1}/{self.iterations}...")
             
             # Render XML to Image for Critique
-            render_path = f"{config.OUTPUT_DIR}/drawio_render_{i}.png"
-            xml_path = f"{config.OUTPUT_DIR}/diagram_v{i}.drawio"
+            render_path = f"{output_dir}/drawio_render_{i}.png"
+            xml_path = f"{output_dir}/diagram_v{i}.drawio"
             
             # Save current XML for rendering
             with open(xml_path, "w") as f:
@@ -119,16 +198,16 @@ class Pipeline:
             print(f"Rendered preview to {render_path}")
             
             # Load rendered image for critique
-            from PIL import Image
             try:
-                rendered_image = Image.open(render_path)
+                rendered_artifact = image_store.load(render_path)
             except Exception as e:
                 print(f"Failed to open rendered image: {e}")
                 break
                 
             # Critique Diagram (Technical/LaTeX check)
             print("Critiquing diagram...")
-            suggestions = self.diagram_critic.critique(rendered_image, input_text)
+            suggestions = self.diagram_critic.critique(rendered_artifact.data(), input_text, xml=xml_content)
+            image_store.release(rendered_artifact)
             print(f"Critique Suggestions: {suggestions}")
             
             if "No changes needed" in suggestions or "no changes needed" in suggestions.lower():
@@ -137,25 +216,85 @@ class Pipeline:
                 
             # Refine XML
             print("Refining XML...")
-            xml_content = self.drawio_builder.build(current_description, critique_suggestions=suggestions)
+            xml_content = self.layout_engine.process(self.drawio_builder.build(current_description, critique_suggestions=suggestions))
             
         # Save Final
-        final_path = f"{config.OUTPUT_DIR}/final_diagram.drawio"
+        final_path = f"{output_dir}/final_diagram.drawio"
         with open(final_path, "w") as f:
             f.write(xml_content)
+            
+        # 5. Export the final diagram for publication
+        if config.EXPORT_FORMATS:
+            print(f"Exporting final diagram ({', '.join(config.EXPORT_FORMATS)})...")
+            for path in self.renderer.export(final_path):
+                print(f"Exported {path}")
         print(f"Generation complete. Saved to {final_path}")
+        return final_path, current_description
+
+    def _generate_hybrid(self, input_text: str, current_description: str, output_dir: str):
+        """
+        Settles the layout with cheap Draw.io XML iterations,
+        then runs a single image-edit pass over the final render for stylistic polish.
+        """
+        # The polish prompt describes the diagram as refined on the sketch
+        final_path, refined_description = self._generate_drawio(input_text, current_description, output_dir)
+        self._polish(final_path, refined_description, output_dir)
+
+    def _polish(self, final_path: str, current_description: str, output_dir: str):
+        # Reuse the PNG exported for publication, only render when PNG is not exported
+        render_path = None
+        if "png" in config.EXPORT_FORMATS and config.EXPORT_SCALES:
+            scale = 1 if 1 in config.EXPORT_SCALES else config.EXPORT_SCALES[0]
+            render_path = self.renderer.export_path(final_path, "png", scale)
+        if not render_path or not os.path.exists(render_path):
+            print("Rendering final diagram for polishing...")
+            render_path = f"{output_dir}/final_render.png"
+            if not self.renderer.render(final_path, render_path):
+                print("Rendering failed. Skipping polish pass.")
+                return
+            
+        try:
+            rendered_artifact = image_store.load(render_path)
+        except Exception as e:
+            print(f"Failed to open rendered image: {e}")
+            return
+            
+        print("Polishing rendered diagram...")
+        polished = self.polisher.polish(rendered_artifact.data(), current_description)
+        image_store.release(rendered_artifact)
+        
+        if not polished:
+            print(f"Failed to polish diagram. Unpolished render kept at {render_path}")
+            return
+            
+        polished_artifact = image_store.put_bytes(polished, f"{output_dir}/final_polished.png")
+        image_store.release(polished_artifact)
+        print("Generation complete (Hybrid). Saved final_polished.png")
 
     def generate_batch(self, inputs: list[str]) -> None:
         """
-        Runs generation for multiple inputs in parallel.
+        Runs generation for multiple inputs, each into its own sub-directory of OUTPUT_DIR.
+        With BATCH_SCHEDULING set to "phased", calls are grouped by model across all inputs
+        (see _generate_batch_phased), otherwise every input runs its own pipeline in parallel.
         """
         import concurrent.futures
         
         print(f"Starting batch generation for {len(inputs)} inputs...")
         
+        output_dirs = []
+        for i in range(len(inputs)):
+            output_dirs.append(os.path.join(config.OUTPUT_DIR, f"batch_{i+1}"))
+            os.makedirs(output_dirs[-1], exist_ok=True)
+        
+        if config.BATCH_SCHEDULING == 'phased':
+            self._generate_batch_phased(inputs, output_dirs)
+            print("Batch generation complete.")
+            print(critique_cache.report())
+            return
+        
         with concurrent.futures.ThreadPoolExecutor() as executor:
             # map inputs to the generate method
-            futures = [executor.submit(self.generate, input_text) for input_text in inputs]
+            futures = [executor.submit(self.generate, input_text, output_dir) for input_text, output_dir in zip(inputs, output_dirs)]
             
             # Wait for all to complete
             for future in concurrent.futures.as_completed(futures):
@@ -165,3 +304,98 @@ class Pipeline:
                     print(f"Error in batch generation: {e}")
                     
         print("Batch generation complete.")
+        print(critique_cache.report())
+
+    def _generate_batch_phased(self, inputs: list[str], output_dirs: list[str]) -> None:
+        """
+        Runs a batch phase by phase: the text model serves the pending text calls of every input,
+        then the image model serves the pending image calls, and so on.
+        VRAM is only cleared when switching between phases, not on every Planner/Visualizer/Critic alternation.
+        """
+        scheduler = PhaseScheduler()
+        jobs = list(zip(inputs, output_dirs))
+        
+        descriptions = scheduler.run("text", [partial(self._plan, input_text) for input_text in inputs])
+        jobs = [(input_text, output_dir, description) for (input_text, output_dir), description in zip(jobs, descriptions) if description]
+        
+        if config.OUTPUT_FORMAT in ['drawio', 'hybrid']:
+            sketches = scheduler.run("image", [partial(self._sketch, description, output_dir) for _, output_dir, description in jobs])
+            results = scheduler.run("text", [
+                partial(self._build_drawio, input_text, description, output_dir, sketch)
+                for (input_text, output_dir, description), sketch in zip(jobs, sketches)
+            ])
+            if config.OUTPUT_FORMAT == 'hybrid':
+                scheduler.run("image", [
+                    # result is (final path, description refined on the sketch)
+                    partial(self._polish, result[0], result[1], output_dir)
+                    for (_, output_dir, _), result in zip(jobs, results) if result
+                ])
+            return
+        
+        drafts = [None] * len(jobs)
+        for i in range(self.iterations):
+            print(f"Iteration {i+1}/{self.iterations} for {len(jobs)} inputs...")
+            artifacts = scheduler.run("image", [partial(self._visualize, description, output_dir, i) for _, output_dir, description in jobs])
+            
+            # Inputs whose image or critique failed stop without a final pass, as in the sequential flow
+            jobs = [job for job, artifact in zip(jobs, artifacts) if artifact]
+            artifacts = [artifact for artifact in artifacts if artifact]
+            descriptions = scheduler.run("text", [
+                partial(self._critique, artifact, input_text, description)
+                for (input_text, _, description), artifact in zip(jobs, artifacts)
+            ])
+            kept = [
+                ((input_text, output_dir, refined), artifact)
+                for (input_text, output_dir, _), refined, artifact in zip(jobs, descriptions, artifacts) if refined is not None
+            ]
+            jobs, drafts = [job for job, _ in kept], [artifact for _, artifact in kept]
+            
+        scheduler.run("image", [
+            partial(self._finalize, description, output_dir, draft)
+            for (_, output_dir, description), draft in zip(jobs, drafts)
+        ])
+        print("Generation complete (Image).")
+
+    def generate_figures(self, paper_text: str, figures: list[dict], output_dir: str = None) -> None:
+        """
+        Generates all figures of one paper in a single run.
+        Retrieval and paper-wide style guidelines are computed once and shared,
+        then the figures are generated in parallel, each into its own sub-directory.
+        Each figure is a dict with a "caption" and an optional "name".
+        """
+        import concurrent.futures
+        
+        output_dir = output_dir or config.OUTPUT_DIR
+        print(f"Starting multi-figure generation for {len(figures)} figures...")
+        
+        print("Gathering reference examples...")
+        examples = self.retriever.retrieve(paper_text)
+        
+        print("Deriving shared style guidelines...")
+        guidelines = self.stylist.guidelines(paper_text, examples)
+        
+        def generate_figure(index: int, figure: dict) -> None:
+            name = figure.get("name") or f"figure_{index+1}"
+            figure_dir = os.path.join(output_dir, name)
+            os.makedirs(figure_dir, exist_ok=True)
+            
+            figure_text = f"{paper_text}\n\nCaption: {figure['caption']}"
+            print(f"[{name}] Generating initial plan...")
+            initial_plan = self.planner.plan(figure_text, examples)
+            
+            print(f"[{name}] Styling the plan...")
+            styled_plan = self.stylist.style(initial_plan, guidelines=guidelines)
+            
+            self._generate_output(figure_text, styled_plan, figure_dir)
+        
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            futures = [executor.submit(generate_figure, i, figure) for i, figure in enumerate(figures)]
+            
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error in multi-figure generation: {e}")
+                    
+        print("Multi-figure generation complete.")
+        print(critique_cache.report())
@@ -0,0 +1,32 @@
+from .client import client_instance
+import concurrent.futures
+
+class PhaseScheduler:
+    """
+    Runs the pending calls of a batch grouped by the model they need ("text" or "image"),
+    so a GPU shared by both models only swaps them at phase boundaries.
+    """
+    def __init__(self):
+        self.active_model = None
+        self.phase_switches = 0
+
+    def run(self, model_kind: str, tasks: list) -> list:
+        """Runs all tasks of one phase concurrently. Failed tasks yield None."""
+        if not tasks:
+            return []
+            
+        if self.active_model is not None and model_kind != self.active_model:
+            print(f"Switching to {model_kind} phase, clearing VRAM...")
+            client_instance.clear_vram(keep=model_kind)
+            self.phase_switches += 1
+        self.active_model = model_kind
+        
+        def run_task(task):
+            try:
+                return task()
+            except Exception as e:
+                print(f"Error in {model_kind} phase: {e}")
+                return None
+        
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            return list(executor.map(run_task, tasks))
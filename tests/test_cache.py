@@ -0,0 +1,69 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from paperbanana.cache import CritiqueCache, critique_cache
+from paperbanana.images import encode_image, perceptual_hash
+from PIL import Image, ImageDraw
+
+def diagram(box_x, color='black'):
+    image = Image.new('RGB', (200, 100), color='white')
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([box_x, 20, box_x + 60, 80], outline=color, width=3)
+    draw.line([box_x + 60, 50, 190, 50], fill=color, width=3)
+    return image
+
+class TestCritiqueCache(unittest.TestCase):
+    def test_perceptual_hash_tolerates_encoding_changes(self):
+        image = diagram(10)
+        resized = image.resize((400, 200))
+        distance = bin(perceptual_hash(encode_image(image), 16) ^ perceptual_hash(encode_image(resized), 16)).count("1")
+        self.assertLessEqual(distance, 8)
+
+    def test_reuses_critique_of_near_identical_image(self):
+        cache = CritiqueCache(threshold=8)
+        compute = MagicMock(return_value="Move box A")
+
+        first = cache.get_or_compute("diagram_critic", ["context"], encode_image(diagram(10)), compute)
+        again = cache.get_or_compute("diagram_critic", ["context"], encode_image(diagram(10).resize((400, 200))), compute)
+
+        self.assertEqual(first, "Move box A")
+        self.assertEqual(again, "Move box A")
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertIn("1/2 hits (50%)", cache.report())
+
+    def test_different_image_or_context_is_not_reused(self):
+        cache = CritiqueCache(threshold=8)
+        compute = MagicMock(side_effect=["First", "Second", "Third", ""])
+
+        cache.get_or_compute("critic", ["context", "plan"], encode_image(diagram(10)), compute)
+        cache.get_or_compute("critic", ["context", "plan"], encode_image(diagram(120)), compute)
+        cache.get_or_compute("critic", ["context", "other plan"], encode_image(diagram(10)), compute)
+        self.assertEqual(compute.call_count, 3)
+
+        # Failed critiques are not cached
+        empty = CritiqueCache(threshold=8)
+        empty.get_or_compute("critic", ["context"], encode_image(diagram(10)), compute)
+        self.assertEqual(empty.get_or_compute("critic", ["context"], encode_image(diagram(10)), MagicMock(return_value="Retried")), "Retried")
+
+    def test_disabled_cache_always_computes(self):
+        cache = CritiqueCache(threshold=64, enabled=False)
+        compute = MagicMock(return_value="Critique")
+        for _ in range(2):
+            cache.get_or_compute("critic", ["context"], encode_image(diagram(10)), compute)
+        self.assertEqual(compute.call_count, 2)
+
+    @patch('paperbanana.agents.client_instance')
+    def test_critic_reuses_critique_across_descriptions(self, mock_client):
+        from paperbanana.agents import Critic
+        critique_cache.clear()
+        self.addCleanup(critique_cache.clear)
+        mock_client.generate_text.return_value = '{"critic_suggestions": "Add labels", "revised_description": "Plan v2"}'
+
+        # A draft near-identical to the previous one for the same input is not critiqued again
+        first = Critic().critique(encode_image(diagram(10)), "Context", "Plan v1")
+        again = Critic().critique(encode_image(diagram(10).resize((400, 200))), "Context", "Plan v2")
+        self.assertEqual(first, again)
+        self.assertEqual(mock_client.generate_text.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
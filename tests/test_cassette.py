@@ -0,0 +1,53 @@
+import unittest
+from unittest.mock import MagicMock
+import os
+import tempfile
+from paperbanana.client import CassetteClient
+from paperbanana.images import encode_image
+from PIL import Image
+
+class TestCassetteClient(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "cassette.jsonl.gz")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_record_and_replay(self):
+        image = Image.new('RGB', (4, 4), color='red')
+        inner = MagicMock()
+        inner.generate_text.side_effect = ["First", "Second", '{"ok": true}']
+        inner.generate_image.return_value = encode_image(image)
+
+        recorder = CassetteClient(self.path, "record", inner)
+        self.assertEqual(recorder.generate_text("Plan"), "First")
+        self.assertEqual(recorder.generate_text("Plan"), "Second")
+        self.assertEqual(recorder.generate_text(["Critique", encode_image(image)], schema={"type": "object"}), '{"ok": true}')
+        self.assertEqual(recorder.generate_image("Draw", size="256x256"), encode_image(image))
+        inner.effective_resolution.return_value = ("1K", None)
+        self.assertEqual(recorder.effective_resolution("1024x1024", 20), ("1K", None))
+
+        replayer = CassetteClient(self.path, "replay")
+        # Identical requests replay in recorded order, then keep serving the last response
+        self.assertEqual(replayer.generate_text("Plan"), "First")
+        self.assertEqual(replayer.generate_text("Plan"), "Second")
+        self.assertEqual(replayer.generate_text("Plan"), "Second")
+        # Images in prompts are matched by content, decoded images and PNG bytes alike
+        self.assertEqual(replayer.generate_text(["Critique", image], schema={"type": "object"}), '{"ok": true}')
+        # Image responses replay as the recorded PNG bytes
+        self.assertEqual(replayer.generate_image("Draw", size="256x256"), encode_image(image))
+        # Backend resolution decisions are replayed too
+        self.assertEqual(replayer.effective_resolution("1024x1024", 20), ("1K", None))
+        self.assertEqual(replayer.misses, 0)
+
+    def test_replay_miss(self):
+        CassetteClient(self.path, "record", MagicMock())
+        replayer = CassetteClient(self.path, "replay")
+
+        self.assertEqual(replayer.generate_text("Unknown"), "")
+        self.assertIsNone(replayer.generate_image("Unknown"))
+        self.assertEqual(replayer.misses, 2)
+
+if __name__ == '__main__':
+    unittest.main()
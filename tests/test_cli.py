@@ -0,0 +1,39 @@
+import unittest
+import json
+import os
+import tempfile
+from paperbanana.cli import load_figure_spec
+
+class TestFigureSpec(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "spec.json")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def load(self, figures):
+        with open(self.path, "w") as f:
+            json.dump({"input": "paper.txt", "figures": figures}, f)
+        return load_figure_spec(self.path)
+
+    def test_valid_spec(self):
+        spec = self.load([{"name": "overview", "caption": "Overview"}, {"caption": "Results"}])
+        self.assertEqual(len(spec["figures"]), 2)
+
+    def test_rejects_invalid_figures(self):
+        invalid = [
+            [{"name": "overview"}],
+            [{"name": "overview", "caption": "A"}, {"name": "overview", "caption": "B"}],
+            # Collides with the default name of the second figure
+            [{"caption": "A"}, {"caption": "B"}, {"name": "figure_2", "caption": "C"}],
+            [{"name": "../escape", "caption": "A"}],
+            [{"name": "..", "caption": "A"}],
+            [{"name": "a\\\\b", "caption": "A"}],
+        ]
+        for figures in invalid:
+            with self.assertRaises(ValueError, msg=str(figures)):
+                self.load(figures)
+
+if __name__ == '__main__':
+    unittest.main()
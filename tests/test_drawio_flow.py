@@ -2,15 +2,27 @@ import unittest
 from unittest.mock import MagicMock, patch
 import os
 import sys
+import tempfile
 
 # Add project root to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from paperbanana.pipeline import Pipeline
 from paperbanana.config import config
+from paperbanana.cache import critique_cache
+from paperbanana.images import encode_image
 from PIL import Image
 
 class TestDrawIOFlow(unittest.TestCase):
+    def setUp(self):
+        critique_cache.clear()
+
+    def set_config(self, name, value):
+        # Restores the global config value after the test
+        patcher = patch.object(config, name, value)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @patch('paperbanana.agents.client_instance')
     @patch('paperbanana.agents.subprocess.run')
     @patch('PIL.Image.open')
@@ -19,8 +31,8 @@ class TestDrawIOFlow(unittest.TestCase):
         # Allow /mock/drawio to exist
         mock_exists.side_effect = lambda path: path == '/mock/drawio' or os.path.join('outputs', 'diagram_v0.drawio') in path or True
         # Setup specific config for this test
-        config.OUTPUT_FORMAT = 'drawio'
-        config.DRAWIO_PATH = '/mock/drawio'
+        self.set_config('OUTPUT_FORMAT', 'drawio')
+        self.set_config('DRAWIO_PATH', '/mock/drawio')
         
         # Mock Client Responses
         mock_client.generate_text.side_effect = [
@@ -34,19 +46,23 @@ class TestDrawIOFlow(unittest.TestCase):
         
         # Mock Image Generation (Sketch)
         mock_image = Image.new('RGB', (100, 100))
-        mock_client.generate_image.return_value = mock_image
+        mock_client.generate_image.return_value = encode_image(mock_image)
         
         # Mock Image Open (for rendering check)
         mock_image_open.return_value = mock_image
         
-        # Mock Subprocess (Renderer)
-        mock_subprocess.return_value = MagicMock(returncode=0)
+        # Mock Subprocess (Renderer): write a PNG to the requested output path
+        def render(cmd, **kwargs):
+            mock_image.save(cmd[cmd.index('-o') + 1], format='PNG')
+            return MagicMock(returncode=0)
+        mock_subprocess.side_effect = render
         
         # Initialize Pipeline
         pipeline = Pipeline(iterations=1)
         
         # Run
-        pipeline.generate("Test Input")
+        with tempfile.TemporaryDirectory() as output_dir:
+            pipeline.generate("Test Input", output_dir=output_dir)
         
         # Assertions
         # 1. Check Sketch generation called
@@ -66,5 +82,143 @@ class TestDrawIOFlow(unittest.TestCase):
         
         print("Draw.io Flow Test Passed.")
 
+    @patch('paperbanana.agents.subprocess.run')
+    @patch('os.path.exists')
+    def test_final_export_formats(self, mock_exists, mock_subprocess):
+        from paperbanana.agents import Renderer
+        mock_exists.return_value = True
+        self.set_config('DRAWIO_PATH', '/mock/drawio')
+        mock_subprocess.return_value = MagicMock(returncode=0)
+        
+        exported = Renderer().export('out/final_diagram.drawio', formats=['png', 'svg', 'pdf'], scales=[1, 2])
+        
+        self.assertEqual(mock_subprocess.call_count, 6)
+        self.assertIn('out/final_diagram.pdf', exported)
+        self.assertIn('out/final_diagram@2x.png', exported)
+        commands = [call.args[0] for call in mock_subprocess.call_args_list]
+        self.assertTrue(all(cmd[-1] == 'out/final_diagram.drawio' for cmd in commands))
+        self.assertIn(['-f', 'svg'], [cmd[2:4] for cmd in commands])
+
+    @patch('paperbanana.agents.subprocess.run')
+    @patch('paperbanana.agents.os.path.exists')
+    def test_export_directory(self, mock_exists, mock_subprocess):
+        from paperbanana.agents import Renderer
+        mock_exists.return_value = True
+        mock_subprocess.return_value = MagicMock(returncode=0)
+        
+        with tempfile.TemporaryDirectory() as output_dir, patch.object(config, 'DRAWIO_PATH', '/mock/drawio'):
+            for name in ['batch_1/final_diagram.drawio', 'batch_1/diagram_v0.drawio', 'batch_2/final_diagram.drawio']:
+                os.makedirs(os.path.join(output_dir, os.path.dirname(name)), exist_ok=True)
+                open(os.path.join(output_dir, name), 'w').close()
+                
+            self.assertTrue(Renderer().export_directory(output_dir, formats=['png', 'svg'], scales=[1, 2]))
+            
+            # Every final diagram is exported next to its source, intermediate diagrams are skipped
+            commands = sorted((cmd[-1], cmd[cmd.index('-o') + 1]) for cmd in (call.args[0] for call in mock_subprocess.call_args_list))
+            expected = sorted(
+                (os.path.join(output_dir, batch, 'final_diagram.drawio'), os.path.join(output_dir, batch, name))
+                for batch in ['batch_1', 'batch_2']
+                for name in ['final_diagram.png', 'final_diagram@2x.png', 'final_diagram.svg', 'final_diagram@2x.svg']
+            )
+            self.assertEqual(commands, expected)
+
+    @patch('paperbanana.agents.subprocess.run')
+    @patch('os.path.exists')
+    def test_final_export_disabled(self, mock_exists, mock_subprocess):
+        from paperbanana.agents import Renderer
+        mock_exists.return_value = True
+        self.set_config('DRAWIO_PATH', '/mock/drawio')
+        self.set_config('EXPORT_FORMATS', [])
+        
+        # An empty EXPORT_FORMATS turns exports off instead of failing
+        self.assertEqual(Renderer().export('out/final_diagram.drawio'), [])
+        self.assertTrue(Renderer().export_directory('out'))
+        mock_subprocess.assert_not_called()
+
+    @patch('paperbanana.agents.client_instance')
+    @patch('paperbanana.agents.subprocess.run')
+    @patch('os.path.exists')
+    def test_hybrid_generation(self, mock_exists, mock_subprocess, mock_client):
+        mock_exists.return_value = True
+        self.set_config('OUTPUT_FORMAT', 'hybrid')
+        self.set_config('DRAWIO_PATH', '/mock/drawio')
+        
+        mock_client.generate_text.side_effect = [
+            "Mock Plan", # Planner
+            "Mock Styled Plan", # Stylist
+            '{"revised_description": "Refined Sketch Desc", "critic_suggestions": "Good sketch"}', # Critic (Sketch)
+            '{"xml": "<mxGraphModel>Mock XML</mxGraphModel>"}', # DrawIOBuilder (Initial)
+            '{"no_changes_needed": true, "suggestions": []}' # DiagramCritic
+        ]
+        mock_image = Image.new('RGB', (100, 100))
+        mock_client.generate_image.return_value = encode_image(mock_image)
+        mock_client.edit_image.return_value = encode_image(Image.new('RGB', (100, 100), color='white'))
+        
+        def render(cmd, **kwargs):
+            mock_image.save(cmd[cmd.index('-o') + 1], format='PNG')
+            return MagicMock(returncode=0)
+        mock_subprocess.side_effect = render
+        
+        pipeline = Pipeline(iterations=2)
+        with tempfile.TemporaryDirectory() as output_dir:
+            pipeline.generate("Test Input", output_dir=output_dir)
+            
+            # Layout settled by XML iterations, then a single polish pass
+            self.assertEqual(mock_client.edit_image.call_count, 1)
+            prompt, image = mock_client.edit_image.call_args.args
+            self.assertTrue(image.startswith(b'\x89PNG'))
+            # The polish prompt describes the diagram as refined on the sketch
+            self.assertIn("Refined Sketch Desc", prompt)
+            self.assertTrue(os.path.exists(os.path.join(output_dir, 'final_polished.png')))
+            # The exported final_diagram.png is polished, Draw.io is not run again
+            outputs = [call.args[0][call.args[0].index('-o') + 1] for call in mock_subprocess.call_args_list]
+            self.assertNotIn(os.path.join(output_dir, 'final_render.png'), outputs)
+            with open(os.path.join(output_dir, 'final_diagram.png'), 'rb') as f:
+                self.assertEqual(image, f.read())
+
+    @patch('paperbanana.agents.client_instance')
+    def test_diagram_critic_structured_output(self, mock_client):
+        from paperbanana.agents import DiagramCritic
+        image = encode_image(Image.new('RGB', (10, 10)))
+        
+        responses = {
+            '{"no_changes_needed": false, "suggestions": ["Align boxes", "Fix $$x^2$$"]}': "- Align boxes\n- Fix $$x^2$$",
+            '{"no_changes_needed": true, "suggestions": []}': "No changes needed.",
+            # Schema-valid but empty: nothing to refine
+            '{"no_changes_needed": false, "suggestions": [" "]}': "No changes needed.",
+            "Move box A to the right.": "Move box A to the right.",
+        }
+        for response, expected in responses.items():
+            critique_cache.clear()
+            mock_client.generate_text.return_value = response
+            self.assertEqual(DiagramCritic().critique(image, "Context"), expected)
+
+    @patch('paperbanana.agents.client_instance')
+    def test_diagram_critic_cache_keyed_by_structure(self, mock_client):
+        from paperbanana.agents import DiagramCritic
+        from PIL import ImageDraw
+        
+        def render(box_x):
+            image = Image.new('RGB', (800, 400), color='white')
+            draw = ImageDraw.Draw(image)
+            draw.rectangle([box_x, 80, box_x + 240, 320], outline='black', width=6)
+            draw.line([box_x + 240, 200, 760, 200], fill='black', width=6)
+            return encode_image(image)
+        
+        def diagram(label, x, cell_id="a"):
+            return (f'<mxGraphModel><root><mxCell id="0"/><mxCell id="1" parent="0"/>'
+                    f'<mxCell id="{cell_id}" value="{label}" vertex="1" parent="1"><mxGeometry x="{x}" y="20" width="60" height="60" as="geometry"/></mxCell>'
+                    f'</root></mxGraphModel>')
+        
+        mock_client.generate_text.side_effect = ["Fix $$x^2$$", "Align A"]
+        critic = DiagramCritic()
+        self.assertEqual(critic.critique(render(40), "Context", xml=diagram("A $$x^2$$", 10)), "Fix $$x^2$$")
+        # Rebuilt with new ids and a slightly moved shape: same labels and connections, near-identical render
+        self.assertEqual(critic.critique(render(42), "Context", xml=diagram("A $$x^2$$", 12, cell_id="v1")), "Fix $$x^2$$")
+        self.assertEqual(mock_client.generate_text.call_count, 1)
+        # A fixed label renders alike at hash resolution but is critiqued again
+        self.assertEqual(critic.critique(render(40), "Context", xml=diagram("A $$x_2$$", 10)), "Align A")
+        self.assertEqual(mock_client.generate_text.call_count, 2)
+
 if __name__ == '__main__':
     unittest.main()
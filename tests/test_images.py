@@ -0,0 +1,59 @@
+import unittest
+import os
+import tempfile
+from paperbanana.images import ImageStore, decode_image, encode_image, to_png
+from PIL import Image
+
+class TestImageStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_put_persists_and_decodes_on_demand(self):
+        store = ImageStore(limit_bytes=10 * 1024 * 1024)
+        path = os.path.join(self.tmp_dir.name, "image.png")
+
+        artifact = store.put(Image.new('RGB', (10, 10), color='red'), path)
+
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(store.resident_bytes, len(artifact.data()))
+        self.assertEqual(artifact.open().size, (10, 10))
+
+        store.release(artifact)
+        self.assertEqual(store.resident_bytes, 0)
+        # Released artifacts are still readable from disk
+        self.assertEqual(decode_image(artifact.data()).size, (10, 10))
+
+    def test_put_bytes_stores_backend_bytes_unchanged(self):
+        store = ImageStore(limit_bytes=10 * 1024 * 1024)
+        path = os.path.join(self.tmp_dir.name, "image.png")
+        data = encode_image(Image.new('RGB', (10, 10), color='red'))
+
+        artifact = store.put_bytes(data, path)
+
+        self.assertIs(artifact.data(), data)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), data)
+
+    def test_to_png_only_reencodes_other_formats(self):
+        png = encode_image(Image.new('RGB', (10, 10), color='red'))
+        self.assertIs(to_png(png), png)
+
+        converted = to_png(encode_image(Image.new('RGB', (10, 10), color='red'), format="JPEG"))
+        self.assertTrue(converted.startswith(b"\x89PNG"))
+        self.assertEqual(decode_image(converted).size, (10, 10))
+
+    def test_memory_cap_spills_oldest(self):
+        store = ImageStore(limit_bytes=1)
+        first = store.put(Image.new('RGB', (10, 10)), os.path.join(self.tmp_dir.name, "first.png"))
+        second = store.put(Image.new('RGB', (10, 10)), os.path.join(self.tmp_dir.name, "second.png"))
+
+        self.assertEqual(first.resident_bytes, 0)
+        self.assertEqual(second.resident_bytes, 0)
+        self.assertLessEqual(store.resident_bytes, store.limit_bytes)
+        self.assertEqual(second.open().size, (10, 10))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import unittest
+from unittest.mock import patch
+import xml.etree.ElementTree as ET
+from paperbanana.layout import repair_xml, has_overlaps, layered_layout, structure_fingerprint
+from paperbanana.config import config
+
+def vertex(cell_id, x, y, w=100, h=40, parent="1", style=None):
+    style = f' style="{style}"' if style else ""
+    return (f'<mxCell id="{cell_id}" value="{cell_id}"{style} vertex="1" parent="{parent}">'
+            f'<mxGeometry x="{x}" y="{y}" width="{w}" height="{h}" as="geometry"/></mxCell>')
+
+def edge(cell_id, source, target):
+    return (f'<mxCell id="{cell_id}" edge="1" parent="1" source="{source}" target="{target}">'
+            f'<mxGeometry relative="1" as="geometry"><Array as="points"><mxPoint x="5" y="5"/></Array></mxGeometry></mxCell>')
+
+def model(*cells):
+    return '<mxGraphModel><root><mxCell id="0"/><mxCell id="1" parent="0"/>' + "".join(cells) + '</root></mxGraphModel>'
+
+def geometry(xml, cell_id):
+    cell = ET.fromstring(xml).find(f".//mxCell[@id='{cell_id}']")
+    g = cell.find("mxGeometry")
+    return tuple(float(g.get(key)) for key in ("x", "y", "width", "height"))
+
+class TestRepairXML(unittest.TestCase):
+    def test_valid_xml_is_unchanged(self):
+        xml = model(vertex("a", 0, 0), vertex("b", 0, 100), edge("e", "a", "b"))
+        repaired, issues = repair_xml(xml)
+        self.assertEqual(issues, [])
+        self.assertEqual(ET.tostring(ET.fromstring(repaired)), ET.tostring(ET.fromstring(xml)))
+
+    def test_repairs_common_defects(self):
+        xml = ("Here is your diagram:\n<mxGraphModel><root>"
+               '<mxCell id="a" value="Q&A" vertex="1" parent="1"/>'
+               + vertex("a", 0, 100) + edge("e1", "a", "missing") + edge("e2", "a", "a_1") +
+               "</root></mxGraphModel>\nEnjoy!")
+        repaired, issues = repair_xml(xml)
+
+        root = ET.fromstring(repaired).find("root")
+        ids = [cell.get("id") for cell in root]
+        self.assertEqual(ids, ["0", "1", "a", "a_1", "e2"])
+        self.assertIsNotNone(root[2].find("mxGeometry"))
+        self.assertTrue(any("dangling target" in issue for issue in issues))
+        self.assertTrue(any("Escaped" in issue for issue in issues))
+
+    def test_removed_edge_takes_its_labels(self):
+        xml = model(vertex("a", 0, 0), edge("e1", "a", "missing"), vertex("label", 0, 0, parent="e1"),
+                    edge("e2", "a", "label"), vertex("b", 0, 100))
+        repaired, issues = repair_xml(xml)
+
+        ids = [cell.get("id") for cell in ET.fromstring(repaired).find("root")]
+        self.assertEqual(ids, ["0", "1", "a", "b"])
+        self.assertTrue(any("'label'" in issue for issue in issues))
+
+    def test_unrecoverable_xml_is_reported(self):
+        xml = "<mxGraphModel><root><mxCell id='a'></root></mxGraphModel>"
+        repaired, issues = repair_xml(xml)
+        self.assertEqual(repaired, xml)
+        self.assertTrue(any("not well-formed" in issue for issue in issues))
+
+class TestLayeredLayout(unittest.TestCase):
+    def test_overlap_detection_ignores_containment(self):
+        self.assertTrue(has_overlaps(model(vertex("a", 0, 0), vertex("b", 50, 20))))
+        self.assertFalse(has_overlaps(model(vertex("panel", 0, 0, 500, 500), vertex("b", 50, 20))))
+
+    def test_layers_follow_edges(self):
+        # a -> b -> c with a cycle back to a, all stacked on top of each other
+        xml = model(vertex("a", 0, 0), vertex("b", 10, 10), vertex("c", 20, 20),
+                    edge("e1", "a", "b"), edge("e2", "b", "c"), edge("e3", "c", "a"))
+        laid_out = layered_layout(xml)
+
+        a, b, c = (geometry(laid_out, cid) for cid in "abc")
+        self.assertLess(a[1] + a[3], b[1])
+        self.assertLess(b[1] + b[3], c[1])
+        self.assertFalse(has_overlaps(laid_out))
+        # Stale waypoints are dropped
+        self.assertIsNone(ET.fromstring(laid_out).find(".//Array"))
+
+    def test_left_to_right_and_frames(self):
+        xml = model(vertex("panel", 0, 0, 400, 400), vertex("a", 10, 10), vertex("b", 20, 20), vertex("c", 30, 30),
+                    edge("e1", "a", "b"), edge("e2", "a", "c"))
+        laid_out = layered_layout(xml, direction="LR")
+
+        a, b, c, panel = (geometry(laid_out, cid) for cid in ("a", "b", "c", "panel"))
+        self.assertLess(a[0] + a[2], b[0])
+        self.assertEqual(b[0], c[0])
+        self.assertFalse(has_overlaps(laid_out))
+        # The panel still frames all of its members
+        for box in (a, b, c):
+            self.assertTrue(panel[0] < box[0] and box[0] + box[2] < panel[0] + panel[2])
+            self.assertTrue(panel[1] < box[1] and box[1] + box[3] < panel[1] + panel[3])
+        # Laying out again is stable
+        self.assertEqual(layered_layout(laid_out, direction="LR"), laid_out)
+
+    def test_shape_with_text_vertex_is_a_single_node(self):
+        # A holds a text vertex, B and C overlap
+        xml = model(vertex("a", 0, 0, 200, 100), vertex("text", 20, 20, style="text;html=1;"),
+                    vertex("b", 300, 0), vertex("c", 310, 10), edge("e1", "a", "b"))
+        self.assertTrue(has_overlaps(xml))
+        laid_out = layered_layout(xml)
+
+        a, text, b = (geometry(laid_out, cid) for cid in ("a", "text", "b"))
+        # A keeps its size, is layered by its edge and carries its text along
+        self.assertEqual(a[2:], (200, 100))
+        self.assertLess(a[1] + a[3], b[1])
+        self.assertEqual((text[0] - a[0], text[1] - a[1]), (20, 20))
+        self.assertFalse(has_overlaps(laid_out))
+
+    def test_container_edges_and_size(self):
+        xml = model(vertex("lane", 0, 0, 400, 300, style="swimlane;"), vertex("x", 20, 40),
+                    vertex("y", 500, 40), edge("e1", "lane", "y"))
+        laid_out = layered_layout(xml)
+
+        lane, x, y = (geometry(laid_out, cid) for cid in ("lane", "x", "y"))
+        # The container is laid out as one vertex at its full size, the edge places y below it
+        self.assertEqual(lane[2:], (400, 300))
+        self.assertLess(lane[1] + lane[3], y[1])
+        self.assertTrue(lane[0] < x[0] and lane[1] < x[1])
+        self.assertFalse(has_overlaps(laid_out))
+        self.assertEqual(layered_layout(laid_out), laid_out)
+
+    def test_partly_overlapping_frames_share_members(self):
+        # Both panels enclose a and b, which can only belong to one of them
+        xml = model(vertex("p1", 0, 0, 200, 200), vertex("p2", 150, 0, 200, 200),
+                    vertex("a", 160, 20, 30, 30), vertex("b", 160, 100, 30, 30))
+        laid_out = layered_layout(xml)
+
+        self.assertFalse(has_overlaps(laid_out))
+        self.assertEqual(layered_layout(laid_out), laid_out)
+
+    def test_structure_fingerprint_ignores_geometry(self):
+        xml = model(vertex("a", 0, 0), vertex("b", 50, 20), edge("e1", "a", "b"))
+        moved = model(vertex("a", 300, 0, 120, 60), vertex("b", 0, 200), edge("edge", "a", "b"))
+        relabelled = xml.replace('value="b"', 'value="c"')
+        reversed_edge = model(vertex("a", 0, 0), vertex("b", 50, 20), edge("e1", "b", "a"))
+
+        self.assertEqual(structure_fingerprint(xml), structure_fingerprint(moved))
+        self.assertEqual(structure_fingerprint(xml), structure_fingerprint(layered_layout(xml)))
+        self.assertNotEqual(structure_fingerprint(xml), structure_fingerprint(relabelled))
+        self.assertNotEqual(structure_fingerprint(xml), structure_fingerprint(reversed_edge))
+
+    @patch('paperbanana.agents.layered_layout', side_effect=ValueError("layout bug"))
+    def test_layout_failure_keeps_repaired_xml(self, mock_layout):
+        from paperbanana.agents import LayoutEngine
+        xml = model(vertex("a", 0, 0), vertex("b", 50, 20), edge("e1", "a", "missing"))
+        with patch.object(config, 'DRAWIO_LAYOUT', 'auto'):
+            processed = LayoutEngine().process(xml)
+
+        mock_layout.assert_called_once()
+        self.assertEqual(processed, repair_xml(xml)[0])
+
+if __name__ == '__main__':
+    unittest.main()
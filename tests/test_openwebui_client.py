@@ -9,9 +9,12 @@ import io
 
 class TestOpenWebUIClient(unittest.TestCase):
     def setUp(self):
-        config.OPENWEBUI_BASE_URL = "http://mock-openwebui:3000/api"
-        config.OPENWEBUI_MODEL = "gemma:12b"
-        config.OPENWEBUI_IMAGE_MODEL = "flux-2-klein-4b"
+        for name, value in [("OPENWEBUI_BASE_URL", "http://mock-openwebui:3000/api"),
+                            ("OPENWEBUI_MODEL", "gemma:12b"),
+                            ("OPENWEBUI_IMAGE_MODEL", "flux-2-klein-4b")]:
+            patcher = patch.object(config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
         self.client = OpenWebUIClient()
 
     @patch('requests.post')
@@ -79,8 +82,8 @@ class TestOpenWebUIClient(unittest.TestCase):
 
         img = self.client.generate_image("A blue square")
         
-        self.assertIsNotNone(img)
-        self.assertIsInstance(img, Image.Image)
+        # The backend's PNG is handed back as is, without a decode round-trip
+        self.assertEqual(img, img_byte_arr.getvalue())
         
         # Verify Request
         args, kwargs = mock_post.call_args
@@ -88,5 +91,52 @@ class TestOpenWebUIClient(unittest.TestCase):
         self.assertEqual(kwargs['json']['model'], "flux-2-klein-4b")
         self.assertEqual(kwargs['json']['prompt'], "A blue square")
 
+    @patch('requests.post')
+    def test_generate_image_resolution(self, mock_post):
+        mock_response = MagicMock()
+        mock_response.json.return_value = {"data": [{"b64_json": base64.b64encode(b"not an image").decode('utf-8')}]}
+        mock_post.return_value = mock_response
+
+        self.client.generate_image("A blue square", size="384x384", steps=4)
+        args, kwargs = mock_post.call_args
+        self.assertEqual(kwargs['json']['size'], "384x384")
+        self.assertEqual(kwargs['json']['steps'], 4)
+
+        # Open WebUI samples with its own configured steps, only the size changes the output
+        self.assertEqual(self.client.effective_resolution("1024x1024", 20), ("1024x1024", None))
+        self.assertEqual(self.client.effective_resolution("512x512", 8), self.client.effective_resolution(None, 20))
+
+    @patch('requests.post')
+    def test_edit_image_size(self, mock_post):
+        mock_response = MagicMock()
+        mock_response.json.return_value = {"data": [{"b64_json": base64.b64encode(b"not an image").decode('utf-8')}]}
+        mock_post.return_value = mock_response
+
+        self.client.edit_image("Re-render", b"draft", size="1024x1024")
+        args, kwargs = mock_post.call_args
+        self.assertEqual(args[0], "http://mock-openwebui:3000/api/images/edit")
+        self.assertEqual(kwargs['json']['size'], "1024x1024")
+        self.assertEqual(kwargs['json']['image'], "data:image/png;base64," + base64.b64encode(b"draft").decode('utf-8'))
+
+    @patch('requests.post')
+    def test_generate_text_with_schema(self, mock_post):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "choices": [{"message": {"content": '{"xml": "<mxGraphModel/>"}'}}]
+        }
+        mock_post.return_value = mock_response
+
+        schema = {"type": "object", "properties": {"xml": {"type": "string"}}, "required": ["xml"]}
+        response = self.client.generate_text("Build XML", schema=schema)
+
+        self.assertEqual(json.loads(response)["xml"], "<mxGraphModel/>")
+
+        # Verify the schema is forwarded as an OpenAI-style response_format
+        args, kwargs = mock_post.call_args
+        response_format = kwargs['json']['response_format']
+        self.assertEqual(response_format['type'], "json_schema")
+        self.assertEqual(response_format['json_schema']['schema'], schema)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,26 @@
 import unittest
 from unittest.mock import MagicMock, patch
 from paperbanana.pipeline import Pipeline
+from paperbanana.config import config
+from paperbanana.cache import critique_cache
+from paperbanana.images import encode_image
 from PIL import Image
 import io
+import os
+import tempfile
+
+def backend_resolutions(mock_client):
+    # A backend that renders every requested size and number of steps
+    mock_client.effective_resolution.side_effect = lambda size=None, steps=None: (size, steps)
 
 class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        # Independent of the OUTPUT_FORMAT in a local config.json
+        patcher = patch.object(config, 'OUTPUT_FORMAT', 'image')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        critique_cache.clear()
+
     @patch("paperbanana.agents.client_instance")
     def test_pipeline_flow(self, mock_client_instance):
         # Mock responses
@@ -16,19 +32,25 @@ class TestPipeline(unittest.TestCase):
         ]
         
         # Visualizer response
-        mock_image = Image.new('RGB', (1, 1), color='red')
+        mock_image = encode_image(Image.new('RGB', (1, 1), color='red'))
         mock_client_instance.generate_image.return_value = mock_image
+        backend_resolutions(mock_client_instance)
         
         # Run Pipeline
         pipeline = Pipeline(iterations=1)
-        pipeline.generate("Test Input")
+        with tempfile.TemporaryDirectory() as output_dir:
+            pipeline.generate("Test Input", output_dir=output_dir)
+            self.assertTrue(os.path.exists(os.path.join(output_dir, "iteration_1.png")))
+            # The final pass is off by default, a run costs only its drafts
+            self.assertFalse(os.path.exists(os.path.join(output_dir, "final.png")))
         
         # Verify calls
         # We expect at least 3 calls to generate_text (Plan, Style, Critic)
         self.assertTrue(mock_client_instance.generate_text.call_count >= 3)
         
         # Visualizer called?
-        mock_client_instance.generate_image.assert_called()
+        mock_client_instance.generate_image.assert_called_once()
+        mock_client_instance.edit_image.assert_not_called()
 
     @patch("paperbanana.agents.client_instance")
     def test_pipeline_batch_flow(self, mock_client_instance):
@@ -43,7 +65,7 @@ class TestPipeline(unittest.TestCase):
         # but within a thread it should be Plan -> Style -> Critic
         
         # Simulating responses
-        def side_effect_text(prompt, model=None):
+        def side_effect_text(prompt, model=None, schema=None):
             if "scientific illustrator" in str(prompt):
                 return "Mock Initial Plan"
             elif "design expert" in str(prompt):
@@ -53,18 +75,152 @@ class TestPipeline(unittest.TestCase):
             return "Generic Response"
 
         mock_client_instance.generate_text.side_effect = side_effect_text
-        mock_client_instance.generate_image.return_value = Image.new('RGB', (1, 1), color='blue')
+        mock_client_instance.generate_image.return_value = encode_image(Image.new('RGB', (1, 1), color='blue'))
+        backend_resolutions(mock_client_instance)
 
-        pipeline = Pipeline(iterations=1)
-        inputs = ["Input 1", "Input 2"]
-        pipeline.generate_batch(inputs)
+        with tempfile.TemporaryDirectory() as tmp_dir, patch.object(config, 'OUTPUT_DIR', tmp_dir):
+            pipeline = Pipeline(iterations=1)
+            inputs = ["Input 1", "Input 2"]
+            pipeline.generate_batch(inputs)
+
+            # Every input gets its own directory under OUTPUT_DIR
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, "batch_1", "iteration_1.png")))
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, "batch_2", "iteration_1.png")))
         
         # Verify that we had calls corresponding to 2 inputs
         # 2 inputs * 3 text calls (Plan, Style, Critic) = 6 text calls minimum
         self.assertTrue(mock_client_instance.generate_text.call_count >= 6)
         
-        # 2 inputs * 1 image call = 2 image calls
+        # 2 inputs * 1 draft = 2 image calls
+        self.assertEqual(mock_client_instance.generate_image.call_count, 2)
+
+    @patch("paperbanana.agents.client_instance")
+    def test_pipeline_multi_figure_flow(self, mock_client_instance):
+        # Retrieval and style guidelines are shared, planning runs once per figure
+        def side_effect_text(prompt, model=None, schema=None):
+            if "figure style guide" in str(prompt):
+                return "Mock Guidelines"
+            elif "scientific illustrator" in str(prompt):
+                return "Mock Initial Plan"
+            elif "design expert" in str(prompt):
+                return "Mock Styled Plan"
+            elif "Visual Designer" in str(prompt):
+                return '{"critic_suggestions": "Nice", "revised_description": "Final"}'
+            return "Generic Response"
+
+        mock_client_instance.generate_text.side_effect = side_effect_text
+        mock_client_instance.generate_image.return_value = encode_image(Image.new('RGB', (1, 1), color='green'))
+        backend_resolutions(mock_client_instance)
+
+        pipeline = Pipeline(iterations=1)
+        figures = [{"name": "overview", "caption": "Overview"}, {"caption": "Results"}]
+        with tempfile.TemporaryDirectory() as output_dir:
+            pipeline.generate_figures("Paper", figures, output_dir=output_dir)
+
+            self.assertTrue(os.path.exists(os.path.join(output_dir, "overview", "iteration_1.png")))
+            self.assertTrue(os.path.exists(os.path.join(output_dir, "figure_2", "iteration_1.png")))
+
+        prompts = [str(call.args[0]) for call in mock_client_instance.generate_text.call_args_list]
+        self.assertEqual(sum("figure style guide" in p for p in prompts), 1)
+        self.assertEqual(sum("scientific illustrator" in p for p in prompts), 2)
+        self.assertTrue(all("Mock Guidelines" in p for p in prompts if "design expert" in p and "figure style guide" not in p))
+        self.assertEqual(mock_client_instance.generate_image.call_count, 2)
+
+    @patch("paperbanana.scheduler.client_instance")
+    @patch("paperbanana.agents.client_instance")
+    def test_pipeline_phased_batch_flow(self, mock_client_instance, mock_scheduler_client):
+        # Calls are grouped by model: all plans, then all images, then all critiques
+        calls = []
+        def side_effect_text(prompt, model=None, schema=None):
+            calls.append("text")
+            if "Visual Designer" in str(prompt):
+                return '{"critic_suggestions": "Nice", "revised_description": "Final"}'
+            return "Mock Plan"
+
+        def side_effect_image(prompt, model=None, size=None, steps=None):
+            calls.append("image")
+            return encode_image(Image.new('RGB', (1, 1), color='blue'))
+
+        def side_effect_edit(prompt, image, model=None, size=None):
+            calls.append("edit")
+            return encode_image(Image.new('RGB', (2, 2), color='blue'))
+
+        mock_client_instance.generate_text.side_effect = side_effect_text
+        mock_client_instance.generate_image.side_effect = side_effect_image
+        mock_client_instance.edit_image.side_effect = side_effect_edit
+        backend_resolutions(mock_client_instance)
+
+        with tempfile.TemporaryDirectory() as tmp_dir, patch.object(config, 'OUTPUT_DIR', tmp_dir), \
+                patch.object(config, 'BATCH_SCHEDULING', 'phased'), patch.object(config, 'FINAL_IMAGE_RESOLUTION', '1024x1024'):
+            pipeline = Pipeline(iterations=1)
+            pipeline.generate_batch(["Input 1", "Input 2", "Input 3"])
+
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, "batch_3", "iteration_1.png")))
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, "batch_3", "final.png")))
+
+        # Plan + Style per input, then one image per input, then one critique per input, then the finals
+        self.assertEqual(calls, ["text"] * 6 + ["image"] * 3 + ["text"] * 3 + ["edit"] * 3)
+        keeps = [call.kwargs["keep"] for call in mock_scheduler_client.clear_vram.call_args_list]
+        self.assertEqual(keeps, ["image", "text", "image"])
+
+    @patch("paperbanana.agents.client_instance")
+    def test_pipeline_resolution_ladder(self, mock_client_instance):
+        mock_client_instance.generate_text.return_value = '{"critic_suggestions": "Nice", "revised_description": "Final"}'
+        mock_client_instance.generate_image.side_effect = lambda prompt, model=None, size=None, steps=None: encode_image(Image.new('RGB', (int(size.split("x")[0]), 1)))
+        mock_client_instance.edit_image.return_value = encode_image(Image.new('RGB', (1024, 1)))
+        backend_resolutions(mock_client_instance)
+
+        with tempfile.TemporaryDirectory() as output_dir, patch.object(config, 'IMAGE_RESOLUTION_LADDER', ["256x256:4", "512x512:8"]), \
+                patch.object(config, 'FINAL_IMAGE_RESOLUTION', "1024x1024"):
+            Pipeline(iterations=3).generate("Test Input", output_dir=output_dir)
+            self.assertTrue(os.path.exists(os.path.join(output_dir, "final.png")))
+            with open(os.path.join(output_dir, "iteration_3.png"), "rb") as f:
+                last_draft = f.read()
+
+        # Drafts climb the ladder and stay on its last rung
+        resolutions = [(call.kwargs["size"], call.kwargs["steps"]) for call in mock_client_instance.generate_image.call_args_list]
+        self.assertEqual(resolutions, [("256x256", 4), ("512x512", 8), ("512x512", 8)])
+        # The final image re-renders the last accepted draft with the refined description, not a new sample
+        prompt, draft = mock_client_instance.edit_image.call_args.args
+        self.assertEqual(draft, last_draft)
+        self.assertIn("Final", prompt)
+        self.assertEqual(mock_client_instance.edit_image.call_args.kwargs["size"], "1024x1024")
+
+    @patch("paperbanana.agents.client_instance")
+    def test_pipeline_final_pass_skipped(self, mock_client_instance):
+        mock_client_instance.generate_text.return_value = '{"critic_suggestions": "Nice", "revised_description": "Final"}'
+        mock_client_instance.generate_image.return_value = encode_image(Image.new('RGB', (1, 1), color='red'))
+        # Imagen-like backend: everything up to 1024 is the same 1K request
+        mock_client_instance.effective_resolution.side_effect = lambda size=None, steps=None: ("1K", None)
+
+        with tempfile.TemporaryDirectory() as output_dir, patch.object(config, 'IMAGE_RESOLUTION_LADDER', ["512x512:8"]), \
+                patch.object(config, 'FINAL_IMAGE_RESOLUTION', "1024x1024"):
+            Pipeline(iterations=2).generate("Test Input", output_dir=output_dir)
+            self.assertFalse(os.path.exists(os.path.join(output_dir, "final.png")))
+
+        # The final pass would come out at the size of the last draft, so only the drafts are generated
         self.assertEqual(mock_client_instance.generate_image.call_count, 2)
+        mock_client_instance.edit_image.assert_not_called()
+
+    @patch("paperbanana.scheduler.client_instance")
+    @patch("paperbanana.agents.client_instance")
+    def test_pipeline_phased_batch_failed_draft(self, mock_client_instance, mock_scheduler_client):
+        # As in the sequential flow, an input whose draft failed gets no final pass
+        mock_client_instance.generate_text.side_effect = lambda prompt, model=None, schema=None: (
+            '{"critic_suggestions": "Nice", "revised_description": "Final"}' if "Visual Designer" in str(prompt) else f"Plan for {prompt}"
+        )
+        mock_client_instance.generate_image.side_effect = lambda prompt, model=None, size=None, steps=None: (
+            None if "Input 2" in prompt else encode_image(Image.new('RGB', (1, 1), color='blue'))
+        )
+        mock_client_instance.edit_image.return_value = encode_image(Image.new('RGB', (2, 2), color='blue'))
+        backend_resolutions(mock_client_instance)
+
+        with tempfile.TemporaryDirectory() as tmp_dir, patch.object(config, 'OUTPUT_DIR', tmp_dir), \
+                patch.object(config, 'BATCH_SCHEDULING', 'phased'), patch.object(config, 'FINAL_IMAGE_RESOLUTION', '1024x1024'):
+            Pipeline(iterations=1).generate_batch(["Input 1", "Input 2"])
+
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, "batch_1", "final.png")))
+            self.assertFalse(os.path.exists(os.path.join(tmp_dir, "batch_2", "final.png")))
 
 if __name__ == "__main__":
     unittest.main()